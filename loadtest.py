@@ -0,0 +1,299 @@
+"""Load test: simulate an ESP32 fleet and dashboards against the API.
+
+Runs the app in-process (default), under a spawned uvicorn (--uvicorn), or
+against any running instance (--url). In-process and uvicorn runs use a
+throwaway SQLite database instead of MySQL, seeded with --seed-hours of
+history so ranged (rollup and LTTB) history queries have data to read.
+Against --url nothing is seeded unless --seed-hours is given explicitly.
+
+Devices post every --interval seconds, which measures latency at a fixed
+load; --interval 0 makes every device post back to back, so throughput
+reflects server capacity and is compared against the baseline too.
+
+    python loadtest.py --devices 50 --interval 1 --dashboards 10 --duration 30
+    python loadtest.py --interval 0 --save-baseline   # record loadtest_baseline.json
+    python loadtest.py --interval 0 --baseline        # fail on regression
+
+loadtest_baseline.json in the repository is a reference recorded with
+`--interval 0` and otherwise default settings. Timings depend on the machine,
+so re-record it (--save-baseline) on the machine that runs the comparison.
+A baseline is only compared against a run with the same settings.
+
+Requires the packages in requirements-dev.txt.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import numpy as np
+
+DEFAULT_BASELINE = "loadtest_baseline.json"
+
+
+class Recorder:
+    """Latencies and errors per endpoint"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, name: str, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        elapsed = time.perf_counter() - start
+        if ok:
+            self.latencies[name].append(elapsed)
+        else:
+            self.errors[name] += 1
+
+    def report(self, duration: float) -> dict:
+        results = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            samples = np.array(self.latencies[name]) * 1000
+            results[name] = {
+                "requests": len(samples),
+                "errors": self.errors[name],
+                "throughput": len(samples) / duration,
+                "p50": float(np.percentile(samples, 50)) if len(samples) else None,
+                "p95": float(np.percentile(samples, 95)) if len(samples) else None,
+                "p99": float(np.percentile(samples, 99)) if len(samples) else None,
+            }
+        return results
+
+
+def reading(**extra) -> dict:
+    return {
+        "moisture_level": round(random.uniform(20, 80), 1),
+        "water_level": round(random.uniform(10, 100), 1),
+        **extra
+    }
+
+
+async def seed(client, devices: list, hours: float, batch_size: int = 1000):
+    """One reading per minute per device for the past `hours`, via /api/sensor/batch"""
+    now = datetime.now(timezone.utc)
+    minutes = int(hours * 60)
+    for device_id in devices:
+        stamps = [now - timedelta(minutes=m) for m in range(minutes, 0, -1)]
+        for i in range(0, len(stamps), batch_size):
+            readings = [reading(timestamp=t.isoformat()) for t in stamps[i:i + batch_size]]
+            response = await client.post("/api/sensor/batch", json={"device_id": device_id, "readings": readings})
+            response.raise_for_status()
+
+
+async def device(client, rec: Recorder, device_id: str, interval: float, stop: float):
+    # Spread the fleet so devices don't all post in the same instant
+    await asyncio.sleep(random.uniform(0, interval))
+    while time.perf_counter() < stop:
+        await rec.call("POST /api/sensor/save",
+                       client.post("/api/sensor/save", json=reading(device_id=device_id)))
+        await asyncio.sleep(interval)
+
+
+async def dashboard(client, rec: Recorder, devices: list, interval: float, stop: float):
+    await asyncio.sleep(random.uniform(0, interval))
+    while time.perf_counter() < stop:
+        device_id = random.choice(devices)
+        await rec.call("GET /api/sensor/latest",
+                       client.get("/api/sensor/latest", params={"device_id": device_id}))
+        await rec.call("GET /api/sensor/history",
+                       client.get("/api/sensor/history", params={"device_id": device_id, "limit": 50}))
+        # Ranged charts: a day from rollups and an hour of LTTB-downsampled raw rows
+        end = datetime.now(timezone.utc)
+        await rec.call("GET /api/sensor/history 24h",
+                       client.get("/api/sensor/history", params={
+                           "device_id": device_id, "start": (end - timedelta(days=1)).isoformat(), "points": 200}))
+        await rec.call("GET /api/sensor/history 1h lttb",
+                       client.get("/api/sensor/history", params={
+                           "device_id": device_id, "start": (end - timedelta(hours=1)).isoformat(),
+                           "points": 200, "mode": "lttb"}))
+        await asyncio.sleep(interval)
+
+
+def _use_sqlite(path: str):
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = path
+
+
+@asynccontextmanager
+async def in_process_client():
+    """httpx client wired straight to the ASGI app, with its lifespan running"""
+    import main
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            yield client
+
+
+@asynccontextmanager
+async def uvicorn_client():
+    """Spawn uvicorn on a free port and connect to it over HTTP"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=os.environ.copy(),
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+            for _ in range(100):
+                try:
+                    await client.get("/health")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            yield client
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def run(args) -> dict:
+    if args.url:
+        client_cm = httpx.AsyncClient(base_url=args.url)
+    elif args.uvicorn:
+        client_cm = uvicorn_client()
+    else:
+        client_cm = in_process_client()
+
+    rec = Recorder()
+    devices = [f"bench-{i}" for i in range(args.devices)]
+    async with client_cm as client:
+        if args.seed_hours > 0:
+            await seed(client, devices, args.seed_hours)
+            # Let the write-behind buffer flush the seeded readings
+            await asyncio.sleep(3)
+        start = time.perf_counter()
+        stop = start + args.duration
+        tasks = [device(client, rec, d, args.interval, stop) for d in devices]
+        tasks += [dashboard(client, rec, devices, args.dashboard_interval, stop)
+                  for _ in range(args.dashboards)]
+        await asyncio.gather(*tasks)
+        duration = time.perf_counter() - start
+    return rec.report(duration)
+
+
+def print_report(results: dict):
+    print(f"{'endpoint':32} {'reqs':>7} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, r in results.items():
+        fmt = lambda v: f"{v:8.2f}" if v is not None else f"{'-':>8}"
+        print(f"{name:32} {r['requests']:7d} {r['errors']:5d} {r['throughput']:8.1f} "
+              f"{fmt(r['p50'])} {fmt(r['p95'])} {fmt(r['p99'])}")
+
+
+def run_config(args) -> dict:
+    """Settings that must match for two runs to be comparable"""
+    target = "url" if args.url else "uvicorn" if args.uvicorn else "in-process"
+    return {
+        "target": target,
+        "devices": args.devices,
+        "interval": args.interval,
+        "dashboards": args.dashboards,
+        "dashboard_interval": args.dashboard_interval,
+        "duration": args.duration,
+        "seed_hours": args.seed_hours,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, slack_ms: float, closed_loop: bool) -> list:
+    """Regressions beyond tolerance: slower p95/p99, more errors and, for
+    closed-loop runs only, lower throughput.
+
+    Latency must also grow by more than slack_ms, so sub-millisecond jitter
+    on fast endpoints isn't reported. With a fixed posting interval the
+    request rate is set by the client, so throughput says nothing there.
+    """
+    problems = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            problems.append(f"{name}: no requests recorded")
+            continue
+        for key in ("p95", "p99"):
+            if base[key] and current[key] and current[key] > base[key] * (1 + tolerance) + slack_ms:
+                problems.append(f"{name}: {key} {current[key]:.2f} ms > baseline {base[key]:.2f} ms")
+        if closed_loop and current["throughput"] < base["throughput"] * (1 - tolerance):
+            problems.append(f"{name}: throughput {current['throughput']:.1f}/s < baseline {base['throughput']:.1f}/s")
+        if current["errors"] > base["errors"]:
+            problems.append(f"{name}: {current['errors']} errors (baseline {base['errors']})")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=20, help="simulated ESP32 devices")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="seconds between readings per device (0 = back to back)")
+    parser.add_argument("--dashboards", type=int, default=5, help="simulated polling dashboards")
+    parser.add_argument("--dashboard-interval", type=float, default=2.0, help="seconds between dashboard polls")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to run")
+    parser.add_argument("--seed-hours", type=float,
+                        help="history to load before the run (default: 24, or 0 with --url)")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    target.add_argument("--uvicorn", action="store_true", help="spawn uvicorn on a local port")
+    parser.add_argument("--sqlite", help="SQLite file for the stand-in database (default: temporary)")
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE, help="compare against a saved baseline")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="save results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression vs baseline (0.25 = 25%%)")
+    parser.add_argument("--slack-ms", type=float, default=1.0, help="latency growth always tolerated, in ms")
+    args = parser.parse_args()
+    if args.seed_hours is None:
+        # Never write history into a server we were only pointed at
+        args.seed_hours = 0 if args.url else 24
+
+    tmpdir = None
+    if not args.url:
+        if args.sqlite:
+            _use_sqlite(args.sqlite)
+        else:
+            tmpdir = tempfile.TemporaryDirectory()
+            _use_sqlite(os.path.join(tmpdir.name, "bench.db"))
+
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if tmpdir:
+            tmpdir.cleanup()
+    print_report(results)
+
+    config = run_config(args)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print(f"\n{args.baseline} was recorded with different settings: {baseline['config']}")
+            sys.exit(2)
+        problems = compare(results, baseline["results"], args.tolerance, args.slack_ms, args.interval == 0)
+        if problems:
+            print("\nRegressions:")
+            for p in problems:
+                print(f"  {p}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,350 +1,2286 @@
-import os
-from datetime import datetime, time, timedelta
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
-import mysql.connector
-from dotenv import load_dotenv
-
-load_dotenv()
-
-app = FastAPI(title="Smart Irrigation API")
-
-# --- CORS MIDDLEWARE ---
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# --- PYDANTIC MODELS ---
-class SensorData(BaseModel):
-    moisture_level: float
-    water_level: float
-    pump_status: str = "OFF"
-
-class ScheduleData(BaseModel):
-    on_time: str
-    off_time: str
-
-class ControlUpdate(BaseModel):
-    type: str
-    target: Optional[str] = None
-    minutes: Optional[int] = None
-
-# --- DATABASE CONNECTION ---
-def get_db_connection():
-    """Connect to Railway MySQL"""
-    try:
-        conn = mysql.connector.connect(
-            host=os.getenv('mysql.railway.internal', 'localhost'),
-            user=os.getenv('root', 'root'),
-            password=os.getenv('iSEQEeYOZUjEzUkBiShOSKACGOqguOuK', ''),
-            database=os.getenv('railway', 'railway'),
-            port=int(os.getenv('3306', 3306)),
-            autocommit=True,
-            connect_timeout=10
-        )
-        return conn
-    except mysql.connector.Error as err:
-        print(f"❌ Database Error: {err}")
-        return None
-
-# --- HELPERS ---
-def parse_time_str(t: str) -> time:
-    """Parse HH:MM or HH:MM:SS"""
-    if not t:
-        raise ValueError("empty time")
-    parts = t.split(":")
-    parts = [int(p) for p in parts]
-    if len(parts) == 2:
-        h, m = parts
-        s = 0
-    elif len(parts) == 3:
-        h, m, s = parts
-    else:
-        raise ValueError("invalid time format")
-    return time(h, m, s)
-
-def is_now_between(on_str: str, off_str: str, now_dt: datetime) -> bool:
-    """Check if now is between on_time and off_time (handles overnight)"""
-    try:
-        on_t = parse_time_str(on_str)
-        off_t = parse_time_str(off_str)
-    except Exception:
-        return False
-    
-    now_t = now_dt.time()
-    
-    if on_t <= off_t:
-        return on_t <= now_t <= off_t
-    else:
-        # overnight range (e.g., 22:00 to 06:00)
-        return now_t >= on_t or now_t <= off_t
-
-# --- ENDPOINTS ---
-
-@app.get("/")
-async def root():
-    return {"status": "online", "message": "Smart Irrigation API - FastAPI"}
-
-@app.get("/health")
-async def health():
-    """Health check"""
-    db = get_db_connection()
-    if db:
-        db.close()
-        return {"status": "healthy", "database": "connected"}
-    return {"status": "unhealthy", "database": "disconnected"}
-
-@app.get("/api/sensor/latest")
-async def get_latest():
-    """Get latest sensor data"""
-    db = get_db_connection()
-    if not db:
-        raise HTTPException(status_code=500, detail="Database offline")
-    
-    try:
-        cursor = db.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT moisture_level, water_level, pump_status, created_at 
-            FROM sensor_data 
-            ORDER BY created_at DESC LIMIT 1
-        """)
-        row = cursor.fetchone()
-        cursor.close()
-        
-        if row:
-            return {
-                "moisture_level": float(row['moisture_level']),
-                "water_level": float(row['water_level']),
-                "pump_status": row['pump_status'],
-                "created_at": row['created_at'].isoformat() if row['created_at'] else None
-            }
-        return {
-            "moisture_level": 0,
-            "water_level": 0,
-            "pump_status": "OFF",
-            "created_at": None
-        }
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
-
-@app.get("/api/sensor/history")
-async def get_history(limit: int = 7):
-    """Get sensor history for charts"""
-    db = get_db_connection()
-    if not db:
-        raise HTTPException(status_code=500, detail="Database offline")
-    
-    try:
-        cursor = db.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT moisture_level, water_level, pump_status, created_at 
-            FROM sensor_data 
-            ORDER BY created_at DESC LIMIT %s
-        """, (limit,))
-        rows = cursor.fetchall()
-        cursor.close()
-        
-        if not rows:
-            return []
-        
-        # Return oldest to newest
-        rows.reverse()
-        return [{
-            "moisture": h['moisture_level'],
-            "water": h['water_level'],
-            "pump_status": h['pump_status'],
-            "time": h['created_at'].strftime("%H:%M") if h['created_at'] else "N/A"
-        } for h in rows]
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
-
-@app.post("/api/sensor/add")
-async def add_sensor_data(data: SensorData):
-    """Add sensor data manually"""
-    db = get_db_connection()
-    if not db:
-        raise HTTPException(status_code=500, detail="Database offline")
-    
-    try:
-        cursor = db.cursor()
-        cursor.execute("""
-            INSERT INTO sensor_data (moisture_level, water_level, pump_status)
-            VALUES (%s, %s, %s)
-        """, (data.moisture_level, data.water_level, data.pump_status))
-        cursor.close()
-        
-        return {"status": "data added"}
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
-
-@app.post("/api/sensor/save")
-async def save_sensor_data(data: SensorData):
-    """Save sensor data from ESP32 with smart pump logic"""
-    db = get_db_connection()
-    if not db:
-        raise HTTPException(status_code=500, detail="Database offline")
-    
-    try:
-        now = datetime.utcnow()
-        target_status = "OFF"
-        
-        # Check manual control
-        cursor = db.cursor(dictionary=True)
-        cursor.execute("SELECT manual_target, pause_until FROM pump_control LIMIT 1")
-        ctrl = cursor.fetchone()
-        
-        if ctrl:
-            # Manual ON takes precedence
-            if ctrl['manual_target'] == 'ON':
-                target_status = "ON"
-            
-            # Pause overrides everything
-            if ctrl['pause_until'] and now < ctrl['pause_until']:
-                target_status = "OFF"
-            else:
-                # Clear expired pause
-                if ctrl['pause_until']:
-                    cursor.execute("UPDATE pump_control SET pause_until = NULL")
-        
-        # Check schedules if no manual ON
-        if target_status != "ON":
-            cursor.execute("""
-                SELECT on_time, off_time FROM pump_schedules 
-                WHERE is_active = TRUE LIMIT 10
-            """)
-            schedules = cursor.fetchall()
-            
-            for sched in schedules:
-                if sched['on_time'] and sched['off_time']:
-                    if is_now_between(sched['on_time'], sched['off_time'], now):
-                        target_status = "ON"
-                        break
-        
-        # Save sensor data
-        cursor.execute("""
-            INSERT INTO sensor_data (moisture_level, water_level, pump_status)
-            VALUES (%s, %s, %s)
-        """, (data.moisture_level, data.water_level, target_status))
-        cursor.close()
-        
-        return {"status": "success", "command": target_status}
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
-
-@app.post("/api/control/update")
-async def update_control(control: ControlUpdate):
-    """Update pump control"""
-    db = get_db_connection()
-    if not db:
-        raise HTTPException(status_code=500, detail="Database offline")
-    
-    try:
-        cursor = db.cursor()
-        
-        if control.type == "manual":
-            # Set manual target
-            cursor.execute("""
-                UPDATE pump_control SET manual_target = %s, pause_until = NULL
-                WHERE id = (SELECT MAX(id) FROM pump_control)
-            """, (control.target.upper() if control.target else "OFF",))
-        
-        elif control.type == "pause":
-            # Set pause duration
-            pause_until = datetime.utcnow() + timedelta(minutes=control.minutes or 0)
-            cursor.execute("""
-                UPDATE pump_control SET pause_until = %s
-                WHERE id = (SELECT MAX(id) FROM pump_control)
-            """, (pause_until,))
-        
-        cursor.close()
-        return {"status": "success"}
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
-
-@app.post("/api/schedule/add")
-async def add_schedule(schedule: ScheduleData):
-    """Add pump schedule"""
-    db = get_db_connection()
-    if not db:
-        raise HTTPException(status_code=500, detail="Database offline")
-    
-    try:
-        cursor = db.cursor()
-        
-        # Deactivate all and add new
-        cursor.execute("UPDATE pump_schedules SET is_active = FALSE")
-        cursor.execute("""
-            INSERT INTO pump_schedules (on_time, off_time, is_active)
-            VALUES (%s, %s, TRUE)
-        """, (schedule.on_time, schedule.off_time))
-        
-        cursor.close()
-        return {"status": "schedule added"}
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
-
-@app.get("/api/schedule/list")
-async def get_schedules():
-    """Get active schedules"""
-    db = get_db_connection()
-    if not db:
-        raise HTTPException(status_code=500, detail="Database offline")
-    
-    try:
-        cursor = db.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT id, on_time, off_time, is_active 
-            FROM pump_schedules 
-            WHERE is_active = TRUE
-        """)
-        schedules = cursor.fetchall()
-        cursor.close()
-        
-        return schedules if schedules else []
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
-
-@app.delete("/api/schedule/{schedule_id}")
-async def delete_schedule(schedule_id: int):
-    """Delete schedule"""
-    db = get_db_connection()
-    if not db:
-        raise HTTPException(status_code=500, detail="Database offline")
-    
-    try:
-        cursor = db.cursor()
-        cursor.execute("UPDATE pump_schedules SET is_active = FALSE WHERE id = %s", (schedule_id,))
-        cursor.close()
-        
-        return {"status": "schedule deleted"}
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
\ No newline at end of file
+import os
+import re
+import io
+import csv
+import json
+import struct
+import asyncio
+import calendar
+import sqlite3
+import heapq
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta, timezone
+from time import monotonic, perf_counter
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, FiniteFloat, constr, field_validator
+from typing import Annotated, List, Optional
+from urllib.parse import quote
+import numpy as np
+import mysql.connector
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- LIFESPAN ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background tasks on startup and release resources on shutdown"""
+    reaper = asyncio.create_task(reap_idle_connections())
+    sensor_buffer.start()
+    try:
+        schema_status["version"] = await run_db(migrate)
+        schema_status["query_plans"] = await run_db(check_query_plans)
+        await control_states.refresh(DEFAULT_DEVICE)
+    except Exception as e:
+        print(f"❌ Database setup failed at startup: {e}")
+    retention = asyncio.create_task(run_retention()) if ARCHIVE_AFTER_DAYS > 0 else None
+    udp = await start_udp_listener()
+    yield
+    if udp:
+        udp.close()
+    if retention:
+        retention.cancel()
+    await sensor_buffer.stop()
+    reaper.cancel()
+    db_pool.close()
+
+app = FastAPI(title="Smart Irrigation API", lifespan=lifespan)
+
+# --- CORS MIDDLEWARE ---
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    # The default handler echoes the rejected input, which can't be encoded
+    # as JSON when it is NaN or Infinity
+    errors = [{k: v for k, v in err.items() if k != "input"} for err in exc.errors()]
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
+
+# --- METRICS ---
+# In-process counters and fixed-bucket histograms rendered in the Prometheus
+# text format at /metrics. Observing is a bisect plus two additions under a
+# lock, cheap enough to stay on for every request and database call.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _label_str(names: tuple, values: tuple) -> str:
+    return ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                    for n, v in zip(names, values))
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            label_str = _label_str(self.labels, labels)
+            lines.append(f"{self.name}{{{label_str}}} {value}" if label_str else f"{self.name} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # labels -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        i = bisect_left(self.buckets, value)  # le is inclusive
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, labels: tuple = ()):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(labels, perf_counter() - start)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in items:
+            label_str = _label_str(self.labels, labels)
+            prefix = label_str + "," if label_str else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            suffix = f"{{{label_str}}}" if label_str else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+http_request_seconds = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route (streaming routes: time until the response starts)",
+    ("method", "route", "status"))
+db_call_seconds = Histogram(
+    "db_call_duration_seconds", "Time spent in each run_db call with a connection held", ("call",))
+db_query_seconds = Histogram(
+    "db_query_duration_seconds", "Latency of individual queries on the ingest path", ("query",))
+db_pool_wait_seconds = Histogram(
+    "db_pool_wait_seconds", "Time spent checking a connection out of the pool")
+db_errors = Counter("db_errors_total", "Database calls that raised", ("call",))
+db_pool_events = Counter("db_pool_events_total", "Connection pool events", ("event",))
+
+# Responses that stay open for as long as the client reads: their full lifetime
+# would swamp the latency buckets, so they are timed until the response starts
+STREAMING_ROUTES = {"/api/sensor/stream", "/api/sensor/export"}
+
+class MetricsMiddleware:
+    """Times every HTTP request, labelled by route template rather than raw path"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None  # endpoint -> path template
+
+    def route_path(self, scope) -> str:
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        if self._routes is None:
+            self._routes = {r.endpoint: r.path for r in app.routes if hasattr(r, "endpoint")}
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = perf_counter()
+        status = 500
+        observed = False
+
+        def observe():
+            nonlocal observed
+            observed = True
+            http_request_seconds.observe(
+                (scope["method"], self.route_path(scope), status), perf_counter() - start)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.route_path(scope) in STREAMING_ROUTES:
+                    observe()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if not observed:
+                observe()
+
+app.add_middleware(MetricsMiddleware)
+
+def render_metrics() -> str:
+    pool = db_pool.stats()
+    lines = []
+    for metric in (http_request_seconds, db_call_seconds, db_query_seconds, db_pool_wait_seconds,
+                   db_errors, db_pool_events, binary_frames):
+        lines.extend(metric.render())
+    gauges = [
+        ("db_pool_size", "Maximum pooled connections", pool["size"]),
+        ("db_pool_open", "Open pooled connections", pool["open"]),
+        ("db_pool_idle", "Idle pooled connections", pool["idle"]),
+        ("sensor_buffer_pending", "Readings waiting in the write-behind buffer", sensor_buffer.pending()),
+        ("live_subscribers", "Connected WebSocket/SSE subscribers", live_hub.subscriber_count()),
+        ("live_dropped_total", "Live events dropped for slow subscribers", live_hub.dropped),
+        ("sensor_buffer_dropped_total", "Readings dropped because the write-behind buffer was full", sensor_buffer.dropped),
+    ]
+    for name, help, value in gauges:
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+# --- PYDANTIC MODELS ---
+DEFAULT_DEVICE = "default"
+# Fits the VARCHAR(64) device_id columns and is safe in file names and URLs
+DEVICE_ID_PATTERN = r"^[A-Za-z0-9_.:-]+$"
+DeviceId = constr(min_length=1, max_length=64, pattern=DEVICE_ID_PATTERN)
+DeviceIdQuery = Annotated[str, Query(min_length=1, max_length=64, pattern=DEVICE_ID_PATTERN)]
+DEVICE_ID_RE = re.compile(DEVICE_ID_PATTERN)
+
+PUMP_STATUS_ALIASES = {"ON": "ON", "OFF": "OFF", "1": "ON", "0": "OFF", "TRUE": "ON", "FALSE": "OFF"}
+
+class SensorData(BaseModel):
+    moisture_level: FiniteFloat
+    water_level: FiniteFloat
+    pump_status: str = "OFF"
+    timestamp: Optional[datetime] = None  # device-side reading time
+    device_id: DeviceId = DEFAULT_DEVICE
+
+    @field_validator("pump_status", mode="before")
+    @classmethod
+    def normalize_pump_status(cls, value):
+        """on/Off/1/0/true/false -> ON/OFF; anything else is only rejected
+        by the endpoints that store the reported status"""
+        key = str(value).strip().upper()
+        return PUMP_STATUS_ALIASES.get(key, key)
+
+class SensorBatch(BaseModel):
+    device_id: DeviceId = DEFAULT_DEVICE  # applies to every reading in the batch
+    readings: List[SensorData]
+
+class ScheduleData(BaseModel):
+    on_time: str
+    off_time: str
+    days: Optional[List[int]] = None  # 0=Monday .. 6=Sunday, None = every day
+    device_id: DeviceId = DEFAULT_DEVICE
+
+class ControlUpdate(BaseModel):
+    type: str
+    target: Optional[str] = None
+    minutes: Optional[int] = None
+    device_id: DeviceId = DEFAULT_DEVICE
+
+# --- DATABASE CONNECTION ---
+DB_BACKEND = os.getenv('DB_BACKEND', 'mysql').lower()
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', 300))
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', 30))
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'smart_irrigation.db')
+
+def connect_mysql():
+    """Open a new connection to Railway MySQL"""
+    return mysql.connector.connect(
+        host=os.getenv('MYSQL_HOST', 'localhost'),
+        user=os.getenv('MYSQL_USER', 'root'),
+        password=os.getenv('MYSQL_PASSWORD', ''),
+        database=os.getenv('MYSQL_DATABASE', 'railway'),
+        port=int(os.getenv('MYSQL_PORT', 3306)),
+        autocommit=True,
+        connect_timeout=10
+    )
+
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter("DATETIME", lambda b: datetime.fromisoformat(b.decode()))
+
+_PARAM_RE = re.compile(r"%([%s])")
+
+class SQLiteCursor:
+    """mysql.connector-style cursor over sqlite3 (%s placeholders, dictionary rows)"""
+
+    def __init__(self, cursor: sqlite3.Cursor, dictionary: bool = False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    def _row(self, row):
+        if row is None:
+            return None
+        return dict(row) if self._dictionary else tuple(row)
+
+    @staticmethod
+    def _sql(sql: str) -> str:
+        return _PARAM_RE.sub(lambda m: "%" if m.group(1) == "%" else "?", sql)
+
+    def execute(self, sql: str, params=()):
+        self._cursor.execute(self._sql(sql), params)
+
+    def executemany(self, sql: str, seq_params):
+        self._cursor.executemany(self._sql(sql), seq_params)
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size: int = 1):
+        return [self._row(r) for r in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+class SQLiteConnection:
+    """Local stand-in for MySQL used in development, tests and benchmarks"""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(
+            path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            uri=path.startswith("file:")
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._closed = False
+
+    def cursor(self, dictionary: bool = False, **kwargs):
+        return SQLiteCursor(self._conn.cursor(), dictionary)
+
+    def start_transaction(self):
+        self._conn.execute("BEGIN")
+
+    def commit(self):
+        self._conn.execute("COMMIT")
+
+    def rollback(self):
+        self._conn.execute("ROLLBACK")
+
+    def is_connected(self) -> bool:
+        return not self._closed
+
+    def close(self):
+        self._closed = True
+        self._conn.close()
+
+def connect_sqlite():
+    """Open a new connection to the local SQLite stand-in"""
+    return SQLiteConnection(SQLITE_PATH)
+
+class PoolTimeout(Exception):
+    pass
+
+class PooledConnection:
+    """Connection checked out from a ConnectionPool; close() returns it"""
+
+    def __init__(self, pool: "ConnectionPool", conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def invalidate(self):
+        """Drop the underlying connection instead of returning it to the pool"""
+        if self._conn is not None:
+            self._pool.discard(self._conn)
+            self._conn = None
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+class ConnectionPool:
+    """Bounded, thread-safe pool with health checks and idle reaping"""
+
+    def __init__(self, connect, size: int, timeout: float, max_idle: float, ping_after: float):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self._idle = []  # (conn, released_at), most recently used last
+        self._open = 0
+        self._cond = threading.Condition()
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def is_healthy(self, conn) -> bool:
+        try:
+            return conn.is_connected()
+        except Exception:
+            return False
+
+    def acquire(self) -> PooledConnection:
+        with db_pool_wait_seconds.time():
+            return self._acquire()
+
+    def _acquire(self) -> PooledConnection:
+        deadline = monotonic() + self.timeout
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        conn, released_at = self._idle.pop()
+                        break
+                    if self._open < self.size:
+                        self._open += 1
+                        break
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        db_pool_events.inc(("timeout",))
+                        raise PoolTimeout(f"no connection available after {self.timeout}s")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    with db_query_seconds.time(("connect",)):
+                        conn = self._connect()
+                    db_pool_events.inc(("connect",))
+                    return PooledConnection(self, conn)
+                except Exception:
+                    db_pool_events.inc(("connect_error",))
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    raise
+
+            # Only ping connections that sat idle long enough to have gone stale
+            if monotonic() - released_at < self.ping_after or self.is_healthy(conn):
+                return PooledConnection(self, conn)
+            db_pool_events.inc(("stale",))
+            self.discard(conn)
+
+    def release(self, conn):
+        with self._cond:
+            self._idle.append((conn, monotonic()))
+            self._cond.notify()
+
+    def discard(self, conn):
+        db_pool_events.inc(("discard",))
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+        self._close_quietly(conn)
+
+    def reap_idle(self) -> int:
+        """Close connections idle for longer than max_idle"""
+        cutoff = monotonic() - self.max_idle
+        with self._cond:
+            stale = [c for c, released_at in self._idle if released_at < cutoff]
+            self._idle = [(c, r) for c, r in self._idle if r >= cutoff]
+            self._open -= len(stale)
+            if stale:
+                self._cond.notify_all()
+        if stale:
+            db_pool_events.inc(("reap",), len(stale))
+        for conn in stale:
+            self._close_quietly(conn)
+        return len(stale)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"size": self.size, "open": self._open, "idle": len(self._idle)}
+
+    def close(self):
+        """Close all idle connections; the pool stays usable"""
+        with self._cond:
+            idle = [c for c, _ in self._idle]
+            self._open -= len(idle)
+            self._idle = []
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+connect_db = connect_sqlite if DB_BACKEND == 'sqlite' else connect_mysql
+
+db_pool = ConnectionPool(
+    connect_db,
+    size=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_idle=DB_POOL_MAX_IDLE,
+    ping_after=DB_POOL_PING_AFTER
+)
+
+# Blocking driver calls run here so they never stall the event loop;
+# one worker per pooled connection means workers never wait on the pool.
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+def get_db_connection():
+    """Check out a pooled database connection"""
+    try:
+        return db_pool.acquire()
+    except (mysql.connector.Error, sqlite3.Error, PoolTimeout) as err:
+        print(f"❌ Database Error: {err}")
+        return None
+
+def _call_with_connection(fn, *args):
+    db = get_db_connection()
+    if not db:
+        raise HTTPException(status_code=500, detail="Database offline")
+
+    start = perf_counter()
+    try:
+        return fn(db, *args)
+    except HTTPException:
+        raise
+    except Exception as e:
+        db_errors.inc((fn.__name__,))
+        print(f"Error: {e}")
+        if not db_pool.is_healthy(db):
+            db.invalidate()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        db_call_seconds.observe((fn.__name__,), perf_counter() - start)
+        db.close()
+
+@contextmanager
+def transaction(db):
+    """Run a block as one transaction on an otherwise autocommitting connection"""
+    db.start_transaction()
+    try:
+        yield
+    except BaseException:
+        try:
+            db.rollback()
+        except Exception:
+            pass
+        raise
+    db.commit()
+
+async def run_db(fn, *args):
+    """Run fn(db, *args) on the database executor with a pooled connection"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DB_EXECUTOR, _call_with_connection, fn, *args)
+
+async def reap_idle_connections(interval: float = 60):
+    """Periodically close pooled connections that have been idle too long"""
+    while True:
+        await asyncio.sleep(interval)
+        db_pool.reap_idle()
+
+# --- SCHEMA ---
+def column_exists(cursor, table: str, column: str) -> bool:
+    if DB_BACKEND == 'sqlite':
+        cursor.execute(f"PRAGMA table_info({table})")
+        return any(row[1] == column for row in cursor.fetchall())
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+def table_exists(cursor, table: str) -> bool:
+    if DB_BACKEND == 'sqlite':
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+    else:
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """, (table,))
+    return cursor.fetchone()[0] > 0
+
+def index_exists(cursor, table: str, index: str) -> bool:
+    if DB_BACKEND == 'sqlite':
+        cursor.execute(f"PRAGMA index_list({table})")
+        return any(row[1] == index for row in cursor.fetchall())
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+def ensure_index(cursor, table: str, index: str, columns: str, unique: bool = False):
+    if not index_exists(cursor, table, index):
+        cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index} ON {table} ({columns})")
+
+# --- MIGRATIONS ---
+# Applied in order on startup and recorded in schema_migrations. MySQL DDL is
+# not transactional, so every step checks before it changes anything and can
+# safely be re-run after a failure (or against a database that was set up by
+# hand before migrations existed).
+ID_COLUMN = "INTEGER PRIMARY KEY AUTOINCREMENT" if DB_BACKEND == 'sqlite' else "BIGINT AUTO_INCREMENT PRIMARY KEY"
+
+def _m001_base_tables(db, cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS sensor_data (
+            id {ID_COLUMN},
+            moisture_level FLOAT NOT NULL,
+            water_level FLOAT NOT NULL,
+            pump_status VARCHAR(3) NOT NULL DEFAULT 'OFF',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS pump_control (
+            id {ID_COLUMN},
+            manual_target VARCHAR(3) NOT NULL DEFAULT 'OFF',
+            pause_until DATETIME NULL
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS pump_schedules (
+            id {ID_COLUMN},
+            on_time VARCHAR(8) NOT NULL,
+            off_time VARCHAR(8) NOT NULL,
+            is_active BOOLEAN NOT NULL DEFAULT TRUE
+        )
+    """)
+
+def _m002_schedule_weekdays(db, cursor):
+    if not column_exists(cursor, "pump_schedules", "weekdays"):
+        cursor.execute("ALTER TABLE pump_schedules ADD COLUMN weekdays SMALLINT NOT NULL DEFAULT 127")
+
+def _m003_device_ids(db, cursor):
+    # Existing rows belong to the default device
+    for table in ("sensor_data", "pump_control", "pump_schedules"):
+        if not column_exists(cursor, table, "device_id"):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN device_id VARCHAR(64) NOT NULL DEFAULT '{DEFAULT_DEVICE}'")
+    if not index_exists(cursor, "pump_control", "uq_pump_control_device"):
+        # Keep the row update_control used to write to (MAX(id)) per device
+        cursor.execute("""
+            DELETE FROM pump_control WHERE id NOT IN (
+                SELECT id FROM (SELECT MAX(id) AS id FROM pump_control GROUP BY device_id) AS keep
+            )
+        """)
+    ensure_index(cursor, "pump_control", "uq_pump_control_device", "device_id", unique=True)
+
+def _m004_hot_query_indexes(db, cursor):
+    # latest/history/export by device and time, schedule loads by device
+    ensure_index(cursor, "sensor_data", "idx_sensor_device_time", "device_id, created_at")
+    ensure_index(cursor, "pump_schedules", "idx_schedules_device_active", "device_id, is_active")
+
+def _m005_rollups(db, cursor):
+    # Rollups are derived data: rebuild them if they predate device_id
+    if table_exists(cursor, "sensor_rollups") and not column_exists(cursor, "sensor_rollups", "device_id"):
+        cursor.execute("DROP TABLE sensor_rollups")
+    if not table_exists(cursor, "sensor_rollups"):
+        cursor.execute("""
+            CREATE TABLE sensor_rollups (
+                device_id VARCHAR(64) NOT NULL,
+                resolution INT NOT NULL,
+                bucket_ts BIGINT NOT NULL,
+                samples INT NOT NULL,
+                moisture_sum DOUBLE NOT NULL,
+                moisture_min DOUBLE NOT NULL,
+                moisture_max DOUBLE NOT NULL,
+                water_sum DOUBLE NOT NULL,
+                water_min DOUBLE NOT NULL,
+                water_max DOUBLE NOT NULL,
+                pump_on INT NOT NULL,
+                PRIMARY KEY (device_id, resolution, bucket_ts)
+            )
+        """)
+        backfill_rollups(db)
+
+def _m006_seed_control(db, cursor):
+    cursor.execute("SELECT COUNT(*) FROM pump_control WHERE device_id = %s", (DEFAULT_DEVICE,))
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("INSERT INTO pump_control (device_id, manual_target) VALUES (%s, 'OFF')", (DEFAULT_DEVICE,))
+
+MIGRATIONS = [
+    (1, "base tables", _m001_base_tables),
+    (2, "schedule weekdays", _m002_schedule_weekdays),
+    (3, "device ids", _m003_device_ids),
+    (4, "hot query indexes", _m004_hot_query_indexes),
+    (5, "sensor rollups", _m005_rollups),
+    (6, "seed control row", _m006_seed_control),
+]
+
+# How long a starting worker waits for another one that is migrating
+MIGRATION_LOCK_TIMEOUT = int(os.getenv('MIGRATION_LOCK_TIMEOUT', 600))
+
+def migrate(db) -> int:
+    """Apply pending migrations; returns the resulting schema version"""
+    cursor = db.cursor()
+    if DB_BACKEND == 'mysql':
+        # Several workers may start at once; only one migrates at a time
+        cursor.execute("SELECT GET_LOCK('smart_irrigation_migrate', %s)", (MIGRATION_LOCK_TIMEOUT,))
+        if cursor.fetchone()[0] != 1:
+            cursor.close()
+            raise RuntimeError(f"migration lock not acquired within {MIGRATION_LOCK_TIMEOUT}s")
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT NOT NULL PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+        for version, name, step in MIGRATIONS:
+            if version in applied:
+                continue
+            print(f"Applying migration {version}: {name}")
+            step(db, cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        
+        if SENSOR_PARTITIONING and DB_BACKEND == 'mysql':
+            ensure_partitions(cursor)
+    finally:
+        if DB_BACKEND == 'mysql':
+            cursor.execute("SELECT RELEASE_LOCK('smart_irrigation_migrate')")
+            cursor.fetchone()
+        cursor.close()
+    return MIGRATIONS[-1][0]
+
+# --- QUERY PLAN CHECK ---
+# The queries on the request path, each with the index it must use. Checked
+# with EXPLAIN after migrating so a missing or unused index shows up in the
+# logs and /health instead of as slowly growing latency.
+HOT_QUERIES = [
+    ("latest reading", "idx_sensor_device_time", """
+        SELECT moisture_level, water_level, pump_status, created_at FROM sensor_data
+        WHERE device_id = %s ORDER BY created_at DESC LIMIT 1
+    """, (DEFAULT_DEVICE,)),
+    ("history range", "idx_sensor_device_time", """
+        SELECT created_at, moisture_level, water_level FROM sensor_data
+        WHERE device_id = %s AND created_at >= %s AND created_at < %s ORDER BY created_at
+    """, (DEFAULT_DEVICE, datetime(2000, 1, 1), datetime(2000, 1, 2))),
+    ("control lookup", "uq_pump_control_device", """
+        SELECT manual_target, pause_until FROM pump_control WHERE device_id = %s
+    """, (DEFAULT_DEVICE,)),
+    ("schedule lookup", "idx_schedules_device_active", """
+        SELECT on_time, off_time, weekdays FROM pump_schedules WHERE device_id = %s AND is_active = TRUE
+    """, (DEFAULT_DEVICE,)),
+    ("rollup buckets", "PRIMARY", """
+        SELECT bucket_ts, samples FROM sensor_rollups
+        WHERE device_id = %s AND resolution = %s AND bucket_ts >= %s AND bucket_ts < %s
+    """, (DEFAULT_DEVICE, 60, 0, 3600)),
+]
+
+def _plan_uses_index(cursor, sql: str, params: tuple, index: str):
+    """(uses index, short plan description)"""
+    if DB_BACKEND == 'sqlite':
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        detail = "; ".join(str(row[-1]) for row in cursor.fetchall())
+        if index == "PRIMARY":
+            return "sqlite_autoindex" in detail or "PRIMARY KEY" in detail, detail
+        return f"INDEX {index}" in detail, detail
+    cursor.execute("EXPLAIN " + sql, params)
+    columns = [c[0] for c in cursor.description]
+    plans = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    used = any(p.get('key') == index for p in plans)
+    detail = "; ".join(f"key={p.get('key')} possible_keys={p.get('possible_keys')}" for p in plans)
+    return used, detail
+
+def check_query_plans(db) -> dict:
+    """EXPLAIN every hot query; returns {name: "ok" | problem description}"""
+    cursor = db.cursor()
+    results = {}
+    for name, index, sql, params in HOT_QUERIES:
+        try:
+            used, detail = _plan_uses_index(cursor, sql, params, index)
+        except Exception as e:
+            used, detail = False, f"EXPLAIN failed: {e}"
+        if used:
+            results[name] = "ok"
+        else:
+            results[name] = f"not using {index} ({detail})"
+            print(f"⚠️ Query plan: {name} is {results[name]}")
+    cursor.close()
+    return results
+
+schema_status = {"version": None, "query_plans": {}}
+
+# --- PARTITIONING ---
+# Optional (MySQL only): monthly RANGE partitions on sensor_data.created_at so
+# time-bounded queries prune to a few partitions and old months can be
+# dropped cheaply. The primary key has to include the partitioning column.
+SENSOR_PARTITIONING = os.getenv('SENSOR_PARTITIONING', '0') == '1'
+SENSOR_PARTITION_MONTHS_AHEAD = int(os.getenv('SENSOR_PARTITION_MONTHS_AHEAD', 3))
+
+def _month_start(dt: datetime, offset: int = 0) -> datetime:
+    months = dt.year * 12 + dt.month - 1 + offset
+    return datetime(months // 12, months % 12 + 1, 1)
+
+def ensure_partitions(cursor):
+    """Partition sensor_data by month and keep partitions ready for the months ahead"""
+    cursor.execute("""
+        SELECT DATA_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'sensor_data' AND COLUMN_NAME = 'created_at'
+    """)
+    column_type = cursor.fetchone()[0].upper()
+    # TIMESTAMP columns may only be partitioned with UNIX_TIMESTAMP()
+    func = "UNIX_TIMESTAMP" if column_type == "TIMESTAMP" else "TO_DAYS"
+    
+    def definition(month: datetime) -> str:
+        bound = _month_start(month, 1)
+        return f"PARTITION p{month:%Y%m} VALUES LESS THAN ({func}('{bound:%Y-%m-%d %H:%M:%S}'))"
+    
+    cursor.execute("""
+        SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'sensor_data' AND PARTITION_NAME IS NOT NULL
+    """)
+    existing = {row[0] for row in cursor.fetchall()}
+    now = datetime.utcnow()
+    
+    if not existing:
+        cursor.execute("SELECT MIN(created_at) FROM sensor_data")
+        month = _month_start(cursor.fetchone()[0] or now)
+        months = []
+        while month <= _month_start(now, SENSOR_PARTITION_MONTHS_AHEAD):
+            months.append(month)
+            month = _month_start(month, 1)
+        cursor.execute(f"ALTER TABLE sensor_data MODIFY created_at {column_type} NOT NULL DEFAULT CURRENT_TIMESTAMP")
+        cursor.execute("ALTER TABLE sensor_data DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at)")
+        cursor.execute(f"""
+            ALTER TABLE sensor_data PARTITION BY RANGE ({func}(created_at)) (
+                {", ".join(definition(m) for m in months)},
+                PARTITION pmax VALUES LESS THAN MAXVALUE
+            )
+        """)
+        return
+    
+    last = max(datetime.strptime(name[1:], "%Y%m") for name in existing if name != "pmax")
+    missing = []
+    month = _month_start(last, 1)
+    while month <= _month_start(now, SENSOR_PARTITION_MONTHS_AHEAD):
+        missing.append(month)
+        month = _month_start(month, 1)
+    if missing:
+        cursor.execute(f"""
+            ALTER TABLE sensor_data REORGANIZE PARTITION pmax INTO (
+                {", ".join(definition(m) for m in missing)},
+                PARTITION pmax VALUES LESS THAN MAXVALUE
+            )
+        """)
+
+# --- ROLLUPS ---
+# Per-minute/hour/day aggregates of sensor_data keyed by bucket start (epoch
+# seconds), kept up to date by the write-behind buffer so long-range charts
+# read a bounded number of rows.
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)
+
+def to_epoch(dt: datetime) -> int:
+    """Naive UTC datetime -> epoch seconds"""
+    return calendar.timegm(dt.timetuple())
+
+def from_epoch(ts: int) -> datetime:
+    """Epoch seconds -> naive UTC datetime"""
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+def to_naive_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def on_conflict(keys: str) -> str:
+    """Upsert clause for a conflict on the unique key over `keys`"""
+    if DB_BACKEND == 'sqlite':
+        return f"ON CONFLICT ({keys}) DO UPDATE SET"
+    return "ON DUPLICATE KEY UPDATE"
+
+def inserted(column: str) -> str:
+    """The value the upsert tried to insert into `column`"""
+    return f"excluded.{column}" if DB_BACKEND == 'sqlite' else f"VALUES({column})"
+
+def _rollup_upsert_sql() -> str:
+    least, greatest = ("MIN", "MAX") if DB_BACKEND == 'sqlite' else ("LEAST", "GREATEST")
+    updates = []
+    for col in ("samples", "moisture_sum", "water_sum", "pump_on"):
+        updates.append(f"{col} = {col} + {inserted(col)}")
+    for col in ("moisture_min", "water_min"):
+        updates.append(f"{col} = {least}({col}, {inserted(col)})")
+    for col in ("moisture_max", "water_max"):
+        updates.append(f"{col} = {greatest}({col}, {inserted(col)})")
+    return f"""
+        INSERT INTO sensor_rollups (device_id, resolution, bucket_ts, samples, moisture_sum,
+            moisture_min, moisture_max, water_sum, water_min, water_max, pump_on)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        {on_conflict("device_id, resolution, bucket_ts")} {", ".join(updates)}
+    """
+
+ROLLUP_UPSERT_SQL = _rollup_upsert_sql()
+
+def aggregate_rollups(rows) -> list:
+    """(device_id, moisture, water, pump_status, created_at) rows -> rollup upsert params"""
+    buckets = {}
+    for device_id, moisture, water, pump_status, created_at in rows:
+        ts = to_epoch(created_at)
+        pump_on = 1 if pump_status == "ON" else 0
+        for res in ROLLUP_RESOLUTIONS:
+            key = (device_id, res, ts - ts % res)
+            b = buckets.get(key)
+            if b is None:
+                buckets[key] = [1, moisture, moisture, moisture, water, water, water, pump_on]
+            else:
+                b[0] += 1
+                b[1] += moisture
+                b[2] = min(b[2], moisture)
+                b[3] = max(b[3], moisture)
+                b[4] += water
+                b[5] = min(b[5], water)
+                b[6] = max(b[6], water)
+                b[7] += pump_on
+    return [(device_id, res, bucket, b[0], b[1], b[2], b[3], b[4], b[5], b[6], b[7])
+            for (device_id, res, bucket), b in buckets.items()]
+
+def update_rollups(cursor, rows):
+    params = aggregate_rollups(rows)
+    if params:
+        cursor.executemany(ROLLUP_UPSERT_SQL, params)
+
+def backfill_rollups(db, chunk_size: int = 10000):
+    """Build rollups for readings stored before sensor_rollups existed"""
+    read = db.cursor()
+    write = db.cursor()
+    last_id = 0
+    while True:
+        read.execute("""
+            SELECT id, device_id, moisture_level, water_level, pump_status, created_at
+            FROM sensor_data WHERE id > %s AND created_at IS NOT NULL
+            ORDER BY id LIMIT %s
+        """, (last_id, chunk_size))
+        chunk = read.fetchall()
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        update_rollups(write, [(d, float(m), float(w), p, c) for _, d, m, w, p, c in chunk])
+    read.close()
+    write.close()
+
+# --- WRITE-BEHIND BUFFER ---
+SENSOR_BUFFER_SIZE = int(os.getenv('SENSOR_BUFFER_SIZE', 200))
+SENSOR_FLUSH_INTERVAL = float(os.getenv('SENSOR_FLUSH_INTERVAL', 2))
+SENSOR_BUFFER_MAX_PENDING = int(os.getenv('SENSOR_BUFFER_MAX_PENDING', 50000))
+SENSOR_BATCH_MAX = int(os.getenv('SENSOR_BATCH_MAX', 1000))
+
+INSERT_READING_SQL = """
+    INSERT INTO sensor_data (device_id, moisture_level, water_level, pump_status, created_at)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+# Errors caused by the values in a row rather than by the connection
+ROW_ERRORS = (mysql.connector.DataError, mysql.connector.IntegrityError,
+              sqlite3.DataError, sqlite3.IntegrityError, sqlite3.InterfaceError)
+
+def _insert_readings(db, rows: list) -> list:
+    """Insert readings and their rollups; returns the rows the database rejected"""
+    # Readings and their rollups commit together, so a requeued batch is
+    # never inserted into sensor_data twice
+    cursor = db.cursor()
+    try:
+        try:
+            with transaction(db):
+                with db_query_seconds.time(("insert",)):
+                    cursor.executemany(INSERT_READING_SQL, rows)
+                with db_query_seconds.time(("rollup_upsert",)):
+                    update_rollups(cursor, rows)
+            return []
+        except ROW_ERRORS:
+            pass
+        
+        # Retry one row at a time so a bad reading can't hold back the rest
+        accepted, rejected = [], []
+        with transaction(db):
+            for row in rows:
+                try:
+                    cursor.execute(INSERT_READING_SQL, row)
+                    accepted.append(row)
+                except ROW_ERRORS as e:
+                    print(f"❌ Dropping reading {row!r}: {e}")
+                    rejected.append(row)
+            update_rollups(cursor, accepted)
+        return rejected
+    finally:
+        cursor.close()
+
+class SensorWriteBuffer:
+    """Coalesces sensor readings into multi-row inserts flushed on size or time.
+
+    A single background task does all flushing: reaching max_size only wakes
+    it early, and after a failed flush it waits a full interval before
+    retrying, however many readings arrive meanwhile. At most max_pending
+    readings are held; beyond that the oldest are dropped.
+    """
+
+    def __init__(self, max_size: int, interval: float, max_pending: int):
+        self.max_size = max_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._rows = []
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._wake = None
+        self._stop = None
+        self._last_failed = False
+
+    def add(self, rows: list):
+        """Queue (device_id, moisture, water, pump_status, created_at) rows for insert"""
+        self._rows.extend(rows)
+        self._drop_overflow()
+        if len(self._rows) >= self.max_size and self._wake is not None:
+            self._wake.set()
+
+    def pending(self) -> int:
+        """Readings accepted but not yet written"""
+        return len(self._rows)
+
+    def _drop_overflow(self):
+        overflow = len(self._rows) - self.max_pending
+        if overflow > 0:
+            del self._rows[:overflow]
+            self.dropped += overflow
+
+    async def flush(self) -> int:
+        async with self._lock:
+            rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            try:
+                rejected = await run_db(_insert_readings, rows)
+            except Exception as e:
+                self._last_failed = True
+                self._rows[:0] = rows
+                self._drop_overflow()
+                print(f"❌ Sensor flush failed, {len(self._rows)} readings pending "
+                      f"({self.dropped} dropped so far): {getattr(e, 'detail', e)}")
+                return 0
+            self._last_failed = False
+            return len(rows) - len(rejected)
+
+    async def _wait(self, event: asyncio.Event, timeout: float):
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while not self._stop.is_set():
+            await self._wait(self._wake, self.interval)
+            self._wake.clear()
+            await self.flush()
+            if self._last_failed:
+                # Back off instead of retrying on every new reading
+                await self._wait(self._stop, self.interval)
+
+    def start(self):
+        # Events are created here so they belong to the running event loop
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Let the flush in progress finish, then flush everything still buffered"""
+        if self._task:
+            self._stop.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+            self._wake = None
+        await self.flush()
+
+sensor_buffer = SensorWriteBuffer(SENSOR_BUFFER_SIZE, SENSOR_FLUSH_INTERVAL, SENSOR_BUFFER_MAX_PENDING)
+
+# --- ARCHIVE ---
+# Readings older than ARCHIVE_AFTER_DAYS move out of sensor_data into
+# append-only fixed-width files, one per device per day, that are read back
+# with np.memmap. Rollups stay in the database, so bucketed history is
+# unaffected; raw reads (LTTB, export) merge archive and table transparently.
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 0))  # 0 disables archiving
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', 3600))
+ARCHIVE_CHUNK = int(os.getenv('ARCHIVE_CHUNK', 5000))
+ARCHIVE_DELETE_BATCH = 500  # ids per DELETE ... IN (...) statement
+
+ARCHIVE_DTYPE = np.dtype([
+    ("id", "<i8"),
+    ("ts", "<u4"),
+    ("moisture", "<f4"),
+    ("water", "<f4"),
+    ("pump_on", "u1"),
+])
+
+class SensorArchive:
+    """Append-only columnar store of archived readings: <root>/<device>/<YYYY-MM-DD>.bin"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _device_dir(self, device_id: str) -> str:
+        name = quote(device_id, safe="-_")
+        if name.startswith("."):
+            name = "%2E" + name[1:]
+        return os.path.join(self.root, name)
+
+    def _path(self, device_id: str, day_ts: int) -> str:
+        return os.path.join(self._device_dir(device_id), f"{from_epoch(day_ts):%Y-%m-%d}.bin")
+
+    def _load(self, path: str) -> Optional[np.ndarray]:
+        """Memory-map a day file, ignoring a torn trailing record"""
+        try:
+            count = os.path.getsize(path) // ARCHIVE_DTYPE.itemsize
+        except FileNotFoundError:
+            return None
+        if count == 0:
+            return None
+        return np.memmap(path, dtype=ARCHIVE_DTYPE, mode="r", shape=(count,))
+
+    def append(self, rows) -> int:
+        """Append (id, device_id, moisture, water, pump_status, created_at) rows.
+
+        Rows whose id is already in the day file are skipped, so re-running
+        after a crash between writing and deleting never duplicates readings.
+        Ids are compared as a set: a day file can gain rows more than once
+        (backdated readings), in any id order.
+        """
+        groups = {}
+        for row_id, device_id, moisture, water, pump_status, created_at in rows:
+            ts = to_epoch(created_at)
+            groups.setdefault((device_id, ts - ts % 86400), []).append(
+                (row_id, ts, moisture, water, 1 if pump_status == "ON" else 0))
+        
+        written = 0
+        for (device_id, day_ts), records in groups.items():
+            path = self._path(device_id, day_ts)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = np.array(records, dtype=ARCHIVE_DTYPE)
+            existing = self._load(path)
+            if existing is not None:
+                data = data[~np.isin(data["id"], existing["id"])]
+                del existing
+            if len(data) == 0:
+                continue
+            with open(path, "ab") as f:
+                f.write(data.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            written += len(data)
+        return written
+
+    @staticmethod
+    def days(start_ts: int, end_ts: int) -> range:
+        """Start of every UTC day overlapping [start_ts, end_ts)"""
+        return range(start_ts - start_ts % 86400, end_ts, 86400)
+
+    def read_day(self, device_id: str, day_ts: int, start_ts: int, end_ts: int) -> np.ndarray:
+        """One day file's readings with start_ts <= ts < end_ts, oldest first"""
+        data = self._load(self._path(device_id, day_ts))
+        if data is None:
+            return np.empty(0, dtype=ARCHIVE_DTYPE)
+        data = data[(data["ts"] >= start_ts) & (data["ts"] < end_ts)]
+        return data[np.argsort(data["ts"], kind="stable")]
+
+    def read(self, device_id: str, start_ts: int, end_ts: int) -> np.ndarray:
+        """Archived readings with start_ts <= ts < end_ts, oldest first"""
+        parts = [self.read_day(device_id, day_ts, start_ts, end_ts) for day_ts in self.days(start_ts, end_ts)]
+        if not parts:
+            return np.empty(0, dtype=ARCHIVE_DTYPE)
+        return np.concatenate(parts)
+
+sensor_archive = SensorArchive(ARCHIVE_DIR)
+
+def archive_old_readings(db, cutoff: datetime) -> int:
+    """Move sensor_data rows created before cutoff into the archive"""
+    cursor = db.cursor()
+    moved = 0
+    while True:
+        cursor.execute("""
+            SELECT id, device_id, moisture_level, water_level, pump_status, created_at
+            FROM sensor_data WHERE created_at < %s
+            ORDER BY id LIMIT %s
+        """, (cutoff, ARCHIVE_CHUNK))
+        chunk = cursor.fetchall()
+        if not chunk:
+            break
+        sensor_archive.append([(i, d, float(m), float(w), p, c) for i, d, m, w, p, c in chunk])
+        # Only the ids just archived: a row committed inside the id range after
+        # the SELECT is picked up by the next chunk instead of being lost
+        ids = [row[0] for row in chunk]
+        for start in range(0, len(ids), ARCHIVE_DELETE_BATCH):
+            batch = ids[start:start + ARCHIVE_DELETE_BATCH]
+            cursor.execute(f"DELETE FROM sensor_data WHERE id IN ({', '.join(['%s'] * len(batch))})", tuple(batch))
+        moved += len(chunk)
+    cursor.close()
+    return moved
+
+async def run_retention():
+    """Periodically archive readings older than ARCHIVE_AFTER_DAYS"""
+    while True:
+        try:
+            cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+            moved = await run_db(archive_old_readings, cutoff)
+            if moved:
+                print(f"Archived {moved} readings older than {cutoff:%Y-%m-%d %H:%M}")
+        except Exception as e:
+            print(f"❌ Archiving failed: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+# --- HELPERS ---
+def parse_time_str(t: str) -> time:
+    """Parse HH:MM or HH:MM:SS"""
+    if not t:
+        raise ValueError("empty time")
+    parts = t.split(":")
+    parts = [int(p) for p in parts]
+    if len(parts) == 2:
+        h, m = parts
+        s = 0
+    elif len(parts) == 3:
+        h, m, s = parts
+    else:
+        raise ValueError("invalid time format")
+    return time(h, m, s)
+
+def reading_time(data: SensorData, now: datetime) -> datetime:
+    """Device-side timestamp as naive UTC, falling back to server time"""
+    if data.timestamp is None:
+        return now
+    return to_naive_utc(data.timestamp)
+
+def require_pump_status(readings: List[SensorData]):
+    for r in readings:
+        if r.pump_status not in ("ON", "OFF"):
+            raise HTTPException(status_code=422, detail=f"pump_status must be ON or OFF, got {r.pump_status!r}")
+
+def sensor_row(data: SensorData, pump_status: str, now: datetime, device_id: Optional[str] = None) -> tuple:
+    return (device_id or data.device_id, data.moisture_level, data.water_level, pump_status, reading_time(data, now))
+
+# --- SCHEDULE INDEX ---
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+ALL_WEEKDAYS = 0b1111111
+
+def days_to_weekdays(days: Optional[List[int]]) -> int:
+    """[0, 2, 4] (Mon, Wed, Fri) -> bitmask with bit 0 = Monday"""
+    if days is None:
+        return ALL_WEEKDAYS
+    mask = 0
+    for d in days:
+        if not 0 <= d <= 6:
+            raise ValueError(f"invalid weekday {d}")
+        mask |= 1 << d
+    return mask
+
+def weekdays_to_days(mask: int) -> List[int]:
+    return [d for d in range(7) if mask & (1 << d)]
+
+def minute_of_week(dt: datetime) -> int:
+    return dt.weekday() * MINUTES_PER_DAY + dt.hour * 60 + dt.minute
+
+class ScheduleIndex:
+    """Active schedules compiled into a minute-of-week bitmap.
+
+    Each schedule switches the pump on from on_time up to (not including)
+    off_time on the weekdays in its mask; an overnight range belongs to the
+    day it starts on. Built once when schedules change, so "is the pump
+    scheduled now" is a single byte lookup.
+    """
+
+    def __init__(self, schedules=()):
+        bits = bytearray(MINUTES_PER_WEEK)
+        for on_t, off_t, weekdays in schedules:
+            on_m = on_t.hour * 60 + on_t.minute
+            off_m = off_t.hour * 60 + off_t.minute + (1 if off_t.second else 0)
+            length = (off_m - on_m) % MINUTES_PER_DAY
+            if length == 0:
+                if off_m == on_m:
+                    continue
+                length = MINUTES_PER_DAY  # e.g. 00:00 to 23:59:59
+            for day in range(7):
+                if not weekdays & (1 << day):
+                    continue
+                start = day * MINUTES_PER_DAY + on_m
+                end = start + length
+                if end <= MINUTES_PER_WEEK:
+                    bits[start:end] = b"\x01" * length
+                else:
+                    # Sunday overnight range wraps into Monday
+                    bits[start:] = b"\x01" * (MINUTES_PER_WEEK - start)
+                    bits[:end - MINUTES_PER_WEEK] = b"\x01" * (end - MINUTES_PER_WEEK)
+        self._bits = bytes(bits)
+        # Minutes at which the scheduled state differs from the minute before
+        self._transitions = [m for m in range(MINUTES_PER_WEEK) if bits[m] != bits[m - 1]]
+
+    def is_on(self, now: datetime) -> bool:
+        return self._bits[minute_of_week(now)] == 1
+
+    def next_transition(self, now: datetime) -> Optional[datetime]:
+        """Time of the next scheduled ON/OFF change, None if it never changes"""
+        if not self._transitions:
+            return None
+        minute = minute_of_week(now)
+        i = bisect_right(self._transitions, minute)
+        if i < len(self._transitions):
+            delta = self._transitions[i] - minute
+        else:
+            delta = self._transitions[0] + MINUTES_PER_WEEK - minute
+        return now.replace(second=0, microsecond=0) + timedelta(minutes=delta)
+
+# --- CONTROL STATE CACHE ---
+CONTROL_CACHE_TTL = float(os.getenv('CONTROL_CACHE_TTL', 30))
+CONTROL_CACHE_MAX_DEVICES = int(os.getenv('CONTROL_CACHE_MAX_DEVICES', 10000))
+
+def _load_control_state(db, device_id: str, now: datetime):
+    cursor = db.cursor(dictionary=True)
+    with db_query_seconds.time(("control_lookup",)):
+        cursor.execute("SELECT manual_target, pause_until FROM pump_control WHERE device_id = %s", (device_id,))
+        ctrl = cursor.fetchone()
+    
+    # Clear expired pause
+    if ctrl and ctrl['pause_until'] and now >= ctrl['pause_until']:
+        cursor.execute("UPDATE pump_control SET pause_until = NULL WHERE device_id = %s", (device_id,))
+        ctrl['pause_until'] = None
+    
+    with db_query_seconds.time(("schedule_lookup",)):
+        cursor.execute("""
+            SELECT on_time, off_time, weekdays FROM pump_schedules 
+            WHERE device_id = %s AND is_active = TRUE
+        """, (device_id,))
+        schedules = cursor.fetchall()
+    cursor.close()
+    return ctrl, schedules
+
+class ControlState:
+    """In-memory copy of one device's pump_control row and active pump_schedules.
+
+    The control/schedule endpoints write through to it; changes made directly
+    in the database (or by another worker process) are picked up after
+    CONTROL_CACHE_TTL seconds by a background refresh.
+    """
+
+    def __init__(self, device_id: str, ttl: float):
+        self.device_id = device_id
+        self.ttl = ttl
+        self.manual_target = "OFF"
+        self.pause_until = None
+        self.schedule_index = ScheduleIndex()
+        self.loaded_at = None
+        self._lock = asyncio.Lock()
+        self._refresh_task = None
+
+    def apply(self, ctrl, schedules):
+        self.manual_target = ctrl['manual_target'] if ctrl else "OFF"
+        self.pause_until = ctrl['pause_until'] if ctrl else None
+        parsed = []
+        for sched in schedules:
+            if sched['on_time'] and sched['off_time']:
+                try:
+                    parsed.append((
+                        parse_time_str(sched['on_time']),
+                        parse_time_str(sched['off_time']),
+                        sched['weekdays']
+                    ))
+                except Exception:
+                    continue
+        self.schedule_index = ScheduleIndex(parsed)
+        self.loaded_at = monotonic()
+
+    async def refresh(self):
+        async with self._lock:
+            ctrl, schedules = await run_db(_load_control_state, self.device_id, datetime.utcnow())
+            self.apply(ctrl, schedules)
+
+    @asynccontextmanager
+    async def writing(self):
+        """Hold off refreshes while a change is written to the database and
+        copied into this state, so a refresh that read the old rows can't
+        apply them afterwards"""
+        async with self._lock:
+            yield self
+
+    def _refresh_in_background(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            print(f"❌ Control state refresh failed for {self.device_id}: {e}")
+
+    async def get(self) -> "ControlState":
+        """Current state; only the very first call waits on the database"""
+        if self.loaded_at is None:
+            await self.refresh()
+        elif monotonic() - self.loaded_at >= self.ttl:
+            self._refresh_in_background()
+        return self
+
+    def command(self, now: datetime) -> str:
+        """Pump command for now: pause > manual ON > schedules"""
+        # Pause overrides everything
+        if self.pause_until:
+            if now < self.pause_until:
+                return "OFF"
+            self.pause_until = None
+        
+        # Manual ON takes precedence
+        if self.manual_target == 'ON':
+            return "ON"
+        
+        return "ON" if self.schedule_index.is_on(now) else "OFF"
+
+    def next_change(self, now: datetime) -> Optional[datetime]:
+        """When command() may next return something different, if known"""
+        if self.pause_until and now < self.pause_until:
+            return self.pause_until
+        if self.manual_target == 'ON':
+            return None
+        return self.schedule_index.next_transition(now)
+
+class ControlStates:
+    """ControlState per device, created on first use.
+
+    Holds at most max_devices states; the least recently used one is evicted
+    (and simply reloaded if that device comes back).
+    """
+
+    def __init__(self, ttl: float, max_devices: int):
+        self.ttl = ttl
+        self.max_devices = max_devices
+        self._states = OrderedDict()
+
+    def state(self, device_id: str) -> ControlState:
+        state = self._states.get(device_id)
+        if state is None:
+            state = self._states[device_id] = ControlState(device_id, self.ttl)
+            self._evict()
+        else:
+            self._states.move_to_end(device_id)
+        return state
+
+    def _evict(self):
+        excess = len(self._states) - self.max_devices
+        if excess <= 0:
+            return
+        # Never evict a state that is mid-refresh or mid-write
+        for device_id in [d for d, s in self._states.items() if not s._lock.locked()][:excess]:
+            del self._states[device_id]
+
+    async def get(self, device_id: str) -> ControlState:
+        return await self.state(device_id).get()
+
+    async def refresh(self, device_id: str):
+        await self.state(device_id).refresh()
+
+control_states = ControlStates(CONTROL_CACHE_TTL, CONTROL_CACHE_MAX_DEVICES)
+
+async def decide_pump_command(device_id: str, now: datetime) -> str:
+    """Pump command computed from cached control state (no database reads)"""
+    state = await control_states.get(device_id)
+    return state.command(now)
+
+# --- DOWNSAMPLING ---
+HISTORY_MAX_POINTS = int(os.getenv('HISTORY_MAX_POINTS', 2000))
+HISTORY_RAW_MAX_SECONDS = int(os.getenv('HISTORY_RAW_MAX_SECONDS', 6 * 3600))
+LTTB_MAX_SOURCE_POINTS = int(os.getenv('LTTB_MAX_SOURCE_POINTS', 20000))
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of n points that keep the shape of y"""
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+    
+    # First and last points are kept; the rest is split into n - 2 buckets
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    selected = np.empty(n, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (size - 1, size)
+        avg_x = x[nlo:nhi].mean()
+        avg_y = y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+def bucket_plan(start_ts: int, end_ts: int, points: int):
+    """Rollup resolution and bucket width (a multiple of it) for ~points buckets"""
+    width = max(1, -(-(end_ts - start_ts) // points))
+    resolution = ROLLUP_RESOLUTIONS[0]
+    for res in ROLLUP_RESOLUTIONS:
+        if res <= width:
+            resolution = res
+    width = -(-width // resolution) * resolution
+    return resolution, width
+
+# --- EXPORT ---
+EXPORT_CHUNK = int(os.getenv('EXPORT_CHUNK', 2000))
+EXPORT_MAX_CONCURRENT = int(os.getenv('EXPORT_MAX_CONCURRENT', 2))
+# Exports hold a connection for the whole download, so they get their own
+# connections and threads instead of taking pool slots and workers from ingest
+EXPORT_EXECUTOR = ThreadPoolExecutor(max_workers=EXPORT_MAX_CONCURRENT, thread_name_prefix="export")
+export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+EXPORT_COLUMNS = ("device_id", "created_at", "moisture_level", "water_level", "pump_status")
+
+def _format_export(device_id: str, rows, fmt: str) -> str:
+    """(created_at, moisture, water, pump_status) rows -> CSV or NDJSON text"""
+    if fmt == "csv":
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerows((device_id, c.isoformat(), float(m), float(w), p) for c, m, w, p in rows)
+        return out.getvalue()
+    return "".join(json.dumps({
+        "device_id": device_id,
+        "created_at": c.isoformat(),
+        "moisture_level": float(m),
+        "water_level": float(w),
+        "pump_status": p
+    }) + "\n" for c, m, w, p in rows)
+
+def _archive_day_rows(device_id: str, day_ts: int, start_ts: int, end_ts: int) -> list:
+    data = sensor_archive.read_day(device_id, day_ts, start_ts, end_ts)
+    return list(zip(map(from_epoch, data["ts"].tolist()), data["moisture"].tolist(), data["water"].tolist(),
+                    ("ON" if on else "OFF" for on in data["pump_on"].tolist())))
+
+def _open_export_cursor(db, device_id: str, start: datetime, end: datetime):
+    # Unbuffered: rows stay on the server side until fetched chunk by chunk
+    cursor = db.cursor(buffered=False)
+    cursor.execute("""
+        SELECT created_at, moisture_level, water_level, pump_status FROM sensor_data
+        WHERE device_id = %s AND created_at >= %s AND created_at < %s
+        ORDER BY created_at
+    """, (device_id, start, end))
+    return cursor
+
+def _export_chunks(cursor, device_id: str, start_ts: int, end_ts: int, fmt: str):
+    """Formatted chunks of archived and table readings, merged in created_at order.
+
+    Archived days usually predate everything left in the table, but a
+    backdated batch can add table rows to a day that is already archived, so
+    each archived day is merged with the table rows that fall before its end.
+    """
+    pending = []  # table rows fetched but not yet written
+    exhausted = False
+    for day_ts in sensor_archive.days(start_ts, end_ts):
+        archived = _archive_day_rows(device_id, day_ts, start_ts, end_ts)
+        if not archived:
+            continue
+        day_end = from_epoch(day_ts + 86400)
+        while not exhausted and (not pending or pending[-1][0] < day_end):
+            rows = cursor.fetchmany(EXPORT_CHUNK)
+            exhausted = not rows
+            pending.extend(rows)
+        split = bisect_left([r[0] for r in pending], day_end)
+        yield _format_export(device_id, heapq.merge(archived, pending[:split], key=lambda r: r[0]), fmt)
+        del pending[:split]
+    
+    if pending:
+        yield _format_export(device_id, pending, fmt)
+    while not exhausted:
+        rows = cursor.fetchmany(EXPORT_CHUNK)
+        exhausted = not rows
+        if rows:
+            yield _format_export(device_id, rows, fmt)
+
+class Export:
+    """One export's dedicated connection and chunk iterator.
+
+    The lock keeps close() from running while a chunk is still being fetched
+    on another thread.
+    """
+
+    def __init__(self, device_id: str, start: datetime, end: datetime, fmt: str):
+        self._lock = threading.Lock()
+        self._conn = connect_db()
+        try:
+            self._cursor = _open_export_cursor(self._conn, device_id, start, end)
+        except Exception:
+            self._conn.close()
+            raise
+        self._chunks = _export_chunks(self._cursor, device_id, to_epoch(start), to_epoch(end), fmt)
+
+    def next_chunk(self) -> Optional[str]:
+        with self._lock:
+            return next(self._chunks, None)
+
+    def close(self):
+        with self._lock:
+            for resource in (self._chunks, self._cursor, self._conn):
+                try:
+                    resource.close()
+                except Exception:
+                    pass
+
+async def _export_stream(export: Export, fmt: str):
+    loop = asyncio.get_running_loop()
+    try:
+        yield ""  # lets export_sensor_data start the generator; see there
+        if fmt == "csv":
+            yield ",".join(EXPORT_COLUMNS) + "\n"
+        while True:
+            chunk = await loop.run_in_executor(EXPORT_EXECUTOR, export.next_chunk)
+            if chunk is None:
+                break
+            if chunk:
+                yield chunk
+    finally:
+        # Nothing is awaited here: when the client disconnects, the stream is
+        # being cancelled and any await would be cancelled too
+        EXPORT_EXECUTOR.submit(export.close)
+        export_slots.release()
+
+# --- LIVE UPDATES ---
+LIVE_QUEUE_SIZE = int(os.getenv('LIVE_QUEUE_SIZE', 32))
+LIVE_KEEPALIVE = float(os.getenv('LIVE_KEEPALIVE', 15))
+# Readings ingested by other worker processes only reach this one through the
+# database, so /api/sensor/latest re-reads it at most this often per device
+LIVE_LATEST_TTL = float(os.getenv('LIVE_LATEST_TTL', 5))
+LIVE_MAX_DEVICES = int(os.getenv('LIVE_MAX_DEVICES', 10000))
+
+def reading_payload(device_id, moisture, water, pump_status, created_at) -> dict:
+    """Reading in the /api/sensor/latest response shape"""
+    return {
+        "device_id": device_id,
+        "moisture_level": float(moisture),
+        "water_level": float(water),
+        "pump_status": pump_status,
+        "created_at": created_at.isoformat() if created_at else None
+    }
+
+class LiveHub:
+    """Latest reading/pump command per device plus fan-out to WebSocket and SSE subscribers.
+
+    Every subscriber gets a bounded queue. A slow client that lets its queue
+    fill up loses its oldest events rather than slowing down ingest. Per-device
+    state is kept for at most max_devices devices, least recently updated
+    evicted first.
+    """
+
+    def __init__(self, queue_size: int, max_devices: int):
+        self.queue_size = queue_size
+        self.max_devices = max_devices
+        self._recent = OrderedDict()  # device_id -> None, least recently updated first
+        self.latest = {}  # device_id -> reading payload
+        self.latest_at = {}
+        self.checked_at = {}  # device_id -> when latest was last compared with the database
+        self.commands = {}
+        self.dropped = 0
+        self._subscribers = {}  # queue -> device_id filter (None = all devices)
+
+    def subscribe(self, device_id: Optional[str] = None) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[queue] = device_id
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.pop(queue, None)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def snapshot(self, device_id: Optional[str] = None) -> dict:
+        if device_id is None:
+            return {"type": "snapshot", "readings": self.latest, "commands": self.commands}
+        return {
+            "type": "snapshot",
+            "readings": {device_id: self.latest[device_id]} if device_id in self.latest else {},
+            "commands": {device_id: self.commands[device_id]} if device_id in self.commands else {}
+        }
+
+    def publish(self, device_id: str, event: dict):
+        for queue, wanted in self._subscribers.items():
+            if wanted is not None and wanted != device_id:
+                continue
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(event)
+
+    def _touch(self, device_id: str):
+        self._recent[device_id] = None
+        self._recent.move_to_end(device_id)
+        while len(self._recent) > self.max_devices:
+            old, _ = self._recent.popitem(last=False)
+            for d in (self.latest, self.latest_at, self.checked_at, self.commands):
+                d.pop(old, None)
+
+    def remember_reading(self, row: tuple) -> bool:
+        """Keep row as the device's latest unless a newer one is known.
+
+        row is a sensor_data tuple (device_id, moisture, water, pump_status, created_at).
+        """
+        device_id, created_at = row[0], row[4]
+        last = self.latest_at.get(device_id)
+        if last is not None and created_at < last:
+            return False
+        self._touch(device_id)
+        self.latest_at[device_id] = created_at
+        self.latest[device_id] = reading_payload(*row)
+        return True
+
+    def publish_reading(self, row: tuple):
+        if self.remember_reading(row):
+            self.publish(row[0], {"type": "reading", "reading": self.latest[row[0]]})
+
+    def fresh_latest(self, device_id: str, ttl: float) -> Optional[dict]:
+        """Latest reading, if it was checked against the database within ttl seconds"""
+        checked_at = self.checked_at.get(device_id)
+        if checked_at is None or monotonic() - checked_at >= ttl:
+            return None
+        return self.latest.get(device_id)
+
+    def publish_command(self, device_id: str, command: str):
+        if command != self.commands.get(device_id):
+            self._touch(device_id)
+            self.commands[device_id] = command
+            self.publish(device_id, {"type": "command", "device_id": device_id, "command": command})
+
+live_hub = LiveHub(LIVE_QUEUE_SIZE, LIVE_MAX_DEVICES)
+
+def ingest(rows: list):
+    """Queue readings for persistence and push the newest per device to subscribers"""
+    sensor_buffer.add(rows)
+    newest = {}
+    for row in rows:
+        if row[0] not in newest or row[4] > newest[row[0]][4]:
+            newest[row[0]] = row
+    for row in newest.values():
+        live_hub.publish_reading(row)
+
+# --- BINARY INGEST ---
+# Compact alternative to the JSON save/batch endpoints for constrained nodes.
+# A frame is a header followed by `count` readings, little-endian:
+#   header:  version u8 (=1) | device_id 16 bytes, NUL-padded ASCII | count u8
+#   reading: timestamp u32 (epoch seconds, 0 = server time) |
+#            moisture u16 (tenths of %) | water u16 (tenths of %) | pump_status u8 (1 = ON)
+# The reply is one byte: 1 = pump ON, 0 = pump OFF.
+BINARY_UDP_PORT = int(os.getenv('BINARY_UDP_PORT', 0))  # 0 disables the UDP listener
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<B16sB")
+FRAME_READING = struct.Struct("<IHHB")
+PUMP_BYTES = {"OFF": b"\x00", "ON": b"\x01"}
+
+binary_frames = Counter("binary_frames_total", "Binary ingest frames", ("transport", "result"))
+
+def decode_frame(payload: bytes, now: datetime):
+    """(device_id, rows) from a binary frame; raises ValueError if malformed"""
+    view = memoryview(payload)
+    if len(view) < FRAME_HEADER.size:
+        raise ValueError("frame shorter than header")
+    version, raw_id, count = FRAME_HEADER.unpack_from(view)
+    if version != FRAME_VERSION:
+        raise ValueError(f"unsupported frame version {version}")
+    if count == 0 or count > SENSOR_BATCH_MAX:
+        raise ValueError(f"reading count must be 1..{SENSOR_BATCH_MAX}")
+    if len(view) != FRAME_HEADER.size + count * FRAME_READING.size:
+        raise ValueError(f"frame length {len(view)} does not match {count} readings")
+    try:
+        device_id = raw_id.rstrip(b"\0").decode("ascii") or DEFAULT_DEVICE
+    except UnicodeDecodeError:
+        raise ValueError("device_id must be ASCII")
+    if not DEVICE_ID_RE.match(device_id):
+        raise ValueError("device_id has invalid characters")
+    
+    rows = [
+        (device_id, moisture / 10, water / 10, "ON" if pump else "OFF", from_epoch(ts) if ts else now)
+        for ts, moisture, water, pump in FRAME_READING.iter_unpack(view[FRAME_HEADER.size:])
+    ]
+    return device_id, rows
+
+async def ingest_frame(payload: bytes) -> bytes:
+    """Store a binary frame and return the one-byte pump command.
+
+    A single reading is handled like /api/sensor/save (it records the decided
+    command); several are handled like /api/sensor/batch (each keeps the
+    pump state the device reported).
+    """
+    now = datetime.utcnow()
+    device_id, rows = decode_frame(payload, now)
+    target_status = await decide_pump_command(device_id, now)
+    if len(rows) == 1:
+        rows[0] = rows[0][:3] + (target_status,) + rows[0][4:]
+    ingest(rows)
+    live_hub.publish_command(device_id, target_status)
+    return PUMP_BYTES[target_status]
+
+class BinaryIngestProtocol(asyncio.DatagramProtocol):
+    """UDP listener: one frame per datagram, the command byte is sent back"""
+
+    def __init__(self):
+        self.transport = None
+        self._tasks = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        task = asyncio.create_task(self._handle(data, addr))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, data: bytes, addr):
+        try:
+            reply = await ingest_frame(data)
+        except ValueError:
+            # Malformed frames get no reply; the device retries on timeout
+            binary_frames.inc(("udp", "invalid"))
+            return
+        except Exception as e:
+            print(f"❌ UDP frame from {addr[0]} failed: {e}")
+            binary_frames.inc(("udp", "error"))
+            return
+        binary_frames.inc(("udp", "ok"))
+        if self.transport:
+            self.transport.sendto(reply, addr)
+
+async def start_udp_listener():
+    """Bind the UDP listener if BINARY_UDP_PORT is set; returns its transport"""
+    if not BINARY_UDP_PORT:
+        return None
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        BinaryIngestProtocol, local_addr=("0.0.0.0", BINARY_UDP_PORT))
+    print(f"✅ Binary ingest listening on UDP port {BINARY_UDP_PORT}")
+    return transport
+
+# --- ENDPOINTS ---
+
+@app.get("/")
+async def root():
+    return {"status": "online", "message": "Smart Irrigation API - FastAPI"}
+
+def _ping(db):
+    return db.is_connected()
+
+@app.get("/health")
+async def health():
+    """Health check"""
+    try:
+        connected = await run_db(_ping)
+    except HTTPException:
+        connected = False
+    if connected:
+        return {"status": "healthy", "database": "connected", "pool": db_pool.stats(), "schema": schema_status}
+    return {"status": "unhealthy", "database": "disconnected", "pool": db_pool.stats(), "schema": schema_status}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of request, database and pool metrics"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+def _fetch_latest(db, device_id: str):
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT moisture_level, water_level, pump_status, created_at 
+        FROM sensor_data 
+        WHERE device_id = %s
+        ORDER BY created_at DESC LIMIT 1
+    """, (device_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row
+
+@app.get("/api/sensor/latest")
+async def get_latest(device_id: DeviceIdQuery = DEFAULT_DEVICE):
+    """Get latest sensor data"""
+    cached = live_hub.fresh_latest(device_id, LIVE_LATEST_TTL)
+    if cached:
+        return cached
+    
+    row = await run_db(_fetch_latest, device_id)
+    
+    # Only fills the cache; subscribers already saw (or never needed) this reading
+    if row:
+        live_hub.remember_reading((device_id, row['moisture_level'], row['water_level'], row['pump_status'], row['created_at']))
+    if device_id in live_hub.latest:
+        live_hub.checked_at[device_id] = monotonic()
+        return live_hub.latest[device_id]
+    return {
+        "device_id": device_id,
+        "moisture_level": 0,
+        "water_level": 0,
+        "pump_status": "OFF",
+        "created_at": None
+    }
+
+def _fetch_history(db, device_id: str, limit: int):
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT moisture_level, water_level, pump_status, created_at 
+        FROM sensor_data 
+        WHERE device_id = %s
+        ORDER BY created_at DESC LIMIT %s
+    """, (device_id, limit))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+def _fetch_buckets(db, device_id: str, start_ts: int, end_ts: int, resolution: int, width: int):
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT bucket_ts - ((bucket_ts - %s) %% %s) AS t,
+            SUM(samples) AS samples,
+            SUM(moisture_sum) AS moisture_sum, MIN(moisture_min) AS moisture_min, MAX(moisture_max) AS moisture_max,
+            SUM(water_sum) AS water_sum, MIN(water_min) AS water_min, MAX(water_max) AS water_max,
+            SUM(pump_on) AS pump_on
+        FROM sensor_rollups
+        WHERE device_id = %s AND resolution = %s AND bucket_ts >= %s AND bucket_ts < %s
+        GROUP BY t ORDER BY t
+    """, (start_ts, width, device_id, resolution, start_ts, end_ts))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+def _fetch_series(db, device_id: str, start_ts: int, end_ts: int, resolution: Optional[int]):
+    """(epoch, moisture, water) rows, raw or from a rollup resolution"""
+    cursor = db.cursor()
+    if resolution is None:
+        cursor.execute("""
+            SELECT created_at, moisture_level, water_level FROM sensor_data
+            WHERE device_id = %s AND created_at >= %s AND created_at < %s
+            ORDER BY created_at
+        """, (device_id, from_epoch(start_ts), from_epoch(end_ts)))
+        rows = [(to_epoch(c), m, w) for c, m, w in cursor.fetchall()]
+        archived = sensor_archive.read(device_id, start_ts, end_ts)
+        if len(archived):
+            rows = sorted(list(zip(archived["ts"].tolist(), archived["moisture"].tolist(), archived["water"].tolist())) + rows)
+    else:
+        cursor.execute("""
+            SELECT bucket_ts, moisture_sum / samples, water_sum / samples FROM sensor_rollups
+            WHERE device_id = %s AND resolution = %s AND bucket_ts >= %s AND bucket_ts < %s
+            ORDER BY bucket_ts
+        """, (device_id, resolution, start_ts, end_ts))
+        rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+async def _bucketed_history(device_id: str, start_ts: int, end_ts: int, points: int):
+    resolution, width = bucket_plan(start_ts, end_ts, points)
+    # Align to the rollup grid so no rollup row straddles two buckets
+    start_ts -= start_ts % resolution
+    rows = await run_db(_fetch_buckets, device_id, start_ts, end_ts, resolution, width)
+    history = []
+    for r in rows:
+        samples = int(r['samples'])
+        history.append({
+            "time": from_epoch(int(r['t'])).isoformat(),
+            "samples": samples,
+            "moisture": float(r['moisture_sum']) / samples,
+            "moisture_min": float(r['moisture_min']),
+            "moisture_max": float(r['moisture_max']),
+            "water": float(r['water_sum']) / samples,
+            "water_min": float(r['water_min']),
+            "water_max": float(r['water_max']),
+            "pump_on_ratio": int(r['pump_on']) / samples
+        })
+    return history
+
+async def _lttb_history(device_id: str, start_ts: int, end_ts: int, points: int):
+    span = end_ts - start_ts
+    resolution = None
+    if span > HISTORY_RAW_MAX_SECONDS:
+        # Long ranges downsample rollup averages instead of raw readings
+        resolution = next((r for r in ROLLUP_RESOLUTIONS if span // r <= LTTB_MAX_SOURCE_POINTS),
+                          ROLLUP_RESOLUTIONS[-1])
+    rows = await run_db(_fetch_series, device_id, start_ts, end_ts, resolution)
+    if not rows:
+        return []
+    
+    data = np.array(rows, dtype=np.float64)
+    t, moisture, water = data[:, 0], data[:, 1], data[:, 2]
+    idx = lttb_indices(t, moisture, points)
+    return [{
+        "time": from_epoch(int(t[i])).isoformat(),
+        "moisture": float(moisture[i]),
+        "water": float(water[i])
+    } for i in idx]
+
+@app.get("/api/sensor/history")
+async def get_history(
+    limit: int = 7,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    points: Optional[int] = None,
+    mode: str = "avg",
+    device_id: DeviceIdQuery = DEFAULT_DEVICE
+):
+    """Get sensor history for charts.
+
+    Without start/points this returns the last `limit` readings. With a time
+    range it returns about `points` values: min/avg/max buckets from the
+    rollup tables (mode=avg) or an LTTB-downsampled series (mode=lttb).
+    """
+    if start is not None or end is not None or points is not None:
+        end_dt = to_naive_utc(end) if end else datetime.utcnow()
+        start_dt = to_naive_utc(start) if start else end_dt - timedelta(days=1)
+        if start_dt >= end_dt:
+            raise HTTPException(status_code=400, detail="start must be before end")
+        points = min(max(points or 200, 3), HISTORY_MAX_POINTS)
+        
+        start_ts, end_ts = to_epoch(start_dt), to_epoch(end_dt)
+        if mode == "avg":
+            return await _bucketed_history(device_id, start_ts, end_ts, points)
+        if mode == "lttb":
+            return await _lttb_history(device_id, start_ts, end_ts, points)
+        raise HTTPException(status_code=400, detail="mode must be 'avg' or 'lttb'")
+    
+    rows = await run_db(_fetch_history, device_id, limit)
+    
+    if not rows:
+        return []
+    
+    # Return oldest to newest
+    rows.reverse()
+    return [{
+        "moisture": h['moisture_level'],
+        "water": h['water_level'],
+        "pump_status": h['pump_status'],
+        "time": h['created_at'].strftime("%H:%M") if h['created_at'] else "N/A"
+    } for h in rows]
+
+@app.post("/api/sensor/add")
+async def add_sensor_data(data: SensorData):
+    """Add sensor data manually"""
+    require_pump_status([data])
+    ingest([sensor_row(data, data.pump_status, datetime.utcnow())])
+    return {"status": "data added"}
+
+@app.post("/api/sensor/save")
+async def save_sensor_data(data: SensorData):
+    """Save sensor data from ESP32 with smart pump logic"""
+    now = datetime.utcnow()
+    target_status = await decide_pump_command(data.device_id, now)
+    
+    # Persistence is deferred to the write-behind buffer
+    ingest([sensor_row(data, target_status, now)])
+    live_hub.publish_command(data.device_id, target_status)
+    return {"status": "success", "command": target_status}
+
+@app.post("/api/sensor/batch")
+async def save_sensor_batch(batch: SensorBatch):
+    """Save buffered readings from a reconnecting ESP32 in one request"""
+    if len(batch.readings) > SENSOR_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {SENSOR_BATCH_MAX} readings")
+    require_pump_status(batch.readings)
+    
+    now = datetime.utcnow()
+    target_status = await decide_pump_command(batch.device_id, now)
+    
+    # Past readings keep the pump state the device reported at the time
+    if batch.readings:
+        ingest([sensor_row(r, r.pump_status, now, batch.device_id) for r in batch.readings])
+    live_hub.publish_command(batch.device_id, target_status)
+    return {"status": "success", "count": len(batch.readings), "command": target_status}
+
+@app.post("/api/sensor/frame")
+async def save_sensor_frame(request: Request):
+    """Save readings sent as a binary frame; replies with the pump command byte"""
+    try:
+        reply = await ingest_frame(await request.body())
+    except ValueError as e:
+        binary_frames.inc(("http", "invalid"))
+        raise HTTPException(status_code=400, detail=str(e))
+    binary_frames.inc(("http", "ok"))
+    return Response(content=reply, media_type="application/octet-stream")
+
+def _update_control(db, control: ControlUpdate, pause_until: datetime):
+    cursor = db.cursor()
+    
+    # Devices get their control row on first update
+    if control.type == "manual":
+        # Set manual target
+        cursor.execute(f"""
+            INSERT INTO pump_control (device_id, manual_target, pause_until)
+            VALUES (%s, %s, NULL)
+            {on_conflict("device_id")} manual_target = {inserted("manual_target")}, pause_until = NULL
+        """, (control.device_id, control.target.upper() if control.target else "OFF"))
+    
+    elif control.type == "pause":
+        # Set pause duration
+        cursor.execute(f"""
+            INSERT INTO pump_control (device_id, manual_target, pause_until)
+            VALUES (%s, 'OFF', %s)
+            {on_conflict("device_id")} pause_until = {inserted("pause_until")}
+        """, (control.device_id, pause_until))
+    
+    cursor.close()
+
+@app.post("/api/control/update")
+async def update_control(control: ControlUpdate):
+    """Update pump control"""
+    pause_until = datetime.utcnow() + timedelta(minutes=control.minutes or 0)
+    
+    # Write through to the cached control state
+    async with control_states.state(control.device_id).writing() as state:
+        await run_db(_update_control, control, pause_until)
+        if control.type == "manual":
+            state.manual_target = control.target.upper() if control.target else "OFF"
+            state.pause_until = None
+        elif control.type == "pause":
+            state.pause_until = pause_until
+    live_hub.publish_command(control.device_id, state.command(datetime.utcnow()))
+    return {"status": "success"}
+
+def _add_schedule(db, schedule: ScheduleData, weekdays: int):
+    cursor = db.cursor()
+    cursor.execute("""
+        INSERT INTO pump_schedules (device_id, on_time, off_time, weekdays, is_active)
+        VALUES (%s, %s, %s, %s, TRUE)
+    """, (schedule.device_id, schedule.on_time, schedule.off_time, weekdays))
+    cursor.close()
+
+async def _refresh_device_control(device_id: str):
+    """Reload a device's schedules after a change and announce its command"""
+    await control_states.refresh(device_id)
+    state = control_states.state(device_id)
+    live_hub.publish_command(device_id, state.command(datetime.utcnow()))
+
+@app.post("/api/schedule/add")
+async def add_schedule(schedule: ScheduleData):
+    """Add pump schedule (runs alongside the other active schedules)"""
+    try:
+        parse_time_str(schedule.on_time)
+        parse_time_str(schedule.off_time)
+        weekdays = days_to_weekdays(schedule.days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid schedule: {e}")
+    
+    await run_db(_add_schedule, schedule, weekdays)
+    await _refresh_device_control(schedule.device_id)
+    return {"status": "schedule added"}
+
+def _fetch_schedules(db, device_id: str):
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT id, device_id, on_time, off_time, weekdays, is_active 
+        FROM pump_schedules 
+        WHERE device_id = %s AND is_active = TRUE
+    """, (device_id,))
+    schedules = cursor.fetchall()
+    cursor.close()
+    for sched in schedules:
+        sched['days'] = weekdays_to_days(sched.pop('weekdays'))
+    return schedules
+
+@app.get("/api/schedule/list")
+async def get_schedules(device_id: DeviceIdQuery = DEFAULT_DEVICE):
+    """Get active schedules"""
+    schedules = await run_db(_fetch_schedules, device_id)
+    return schedules if schedules else []
+
+def _delete_schedule(db, schedule_id: int) -> Optional[str]:
+    cursor = db.cursor()
+    cursor.execute("SELECT device_id FROM pump_schedules WHERE id = %s", (schedule_id,))
+    row = cursor.fetchone()
+    cursor.execute("UPDATE pump_schedules SET is_active = FALSE WHERE id = %s", (schedule_id,))
+    cursor.close()
+    return row[0] if row else None
+
+@app.get("/api/schedule/next")
+async def get_next_change(device_id: DeviceIdQuery = DEFAULT_DEVICE):
+    """Current pump command and when it next changes, so devices can sleep"""
+    now = datetime.utcnow()
+    state = await control_states.get(device_id)
+    next_change = state.next_change(now)
+    return {
+        "command": state.command(now),
+        "next_change": next_change.isoformat() if next_change else None,
+        "seconds_until": max(0, int((next_change - now).total_seconds())) if next_change else None
+    }
+
+@app.delete("/api/schedule/{schedule_id}")
+async def delete_schedule(schedule_id: int):
+    """Delete schedule"""
+    device_id = await run_db(_delete_schedule, schedule_id)
+    if device_id:
+        await _refresh_device_control(device_id)
+    return {"status": "schedule deleted"}
+
+@app.websocket("/ws/live")
+async def live_websocket(websocket: WebSocket, device_id: Optional[DeviceIdQuery] = None):
+    """Push new readings and pump command changes (all devices or one) to a dashboard"""
+    await websocket.accept()
+    queue = live_hub.subscribe(device_id)
+    
+    async def forward():
+        while True:
+            await websocket.send_json(await queue.get())
+    
+    async def drain():
+        # Anything the client sends, text or binary, is ignored; receiving is
+        # how we notice it left
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    
+    tasks = []
+    try:
+        await websocket.send_json(live_hub.snapshot(device_id))
+        tasks = [asyncio.create_task(forward()), asyncio.create_task(drain())]
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            # Retrieve the exception so it isn't reported as never retrieved;
+            # either way the connection is finished
+            if not task.cancelled() and task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                print(f"❌ Live WebSocket failed: {task.exception()}")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        live_hub.unsubscribe(queue)
+
+@app.get("/api/sensor/stream")
+async def live_stream(request: Request, device_id: Optional[DeviceIdQuery] = None):
+    """Server-Sent Events version of /ws/live"""
+    async def events():
+        queue = live_hub.subscribe(device_id)
+        try:
+            yield f"data: {json.dumps(live_hub.snapshot(device_id))}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), LIVE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            live_hub.unsubscribe(queue)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/sensor/export")
+async def export_sensor_data(
+    start: datetime,
+    end: Optional[datetime] = None,
+    device_id: DeviceIdQuery = DEFAULT_DEVICE,
+    format: str = "csv"
+):
+    """Stream raw readings for a time range as CSV or NDJSON"""
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'ndjson'")
+    end_dt = to_naive_utc(end) if end else datetime.utcnow()
+    start_dt = to_naive_utc(start)
+    if start_dt >= end_dt:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    if export_slots.locked():
+        raise HTTPException(status_code=503, detail="Too many exports in progress, try again later")
+    await export_slots.acquire()
+    loop = asyncio.get_running_loop()
+    try:
+        export = await loop.run_in_executor(EXPORT_EXECUTOR, Export, device_id, start_dt, end_dt, format)
+    except Exception as e:
+        export_slots.release()
+        print(f"Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    # Started here so its finally (which closes the connection and frees the
+    # slot) runs even if the client is gone before the first chunk is sent
+    stream = _export_stream(export, format)
+    await stream.__anext__()
+    
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"sensor_{quote(device_id, safe='')}_{start_dt:%Y%m%d}_{end_dt:%Y%m%d}.{format}"
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,43 @@
+import os
+import sys
+import asyncio
+import tempfile
+
+# main reads its configuration at import time: point it at a throwaway
+# SQLite database and archive directory before any test imports it
+_tmp = tempfile.mkdtemp(prefix="smart_irrigation_tests_")
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_tmp, "test.db")
+os.environ["ARCHIVE_DIR"] = os.path.join(_tmp, "archive")
+os.environ["ARCHIVE_AFTER_DAYS"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import main
+
+
+def run_with_app(coro_fn):
+    """Run coro_fn() inside the app's lifespan (migrations, buffer, pool)"""
+    async def runner():
+        async with main.lifespan(main.app):
+            return await coro_fn()
+    return asyncio.run(runner())
+
+
+def query(sql: str, params=()):
+    db = main.db_pool.acquire()
+    try:
+        cursor = db.cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+    with TestClient(main.app) as c:
+        yield c
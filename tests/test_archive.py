@@ -0,0 +1,106 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from main import ARCHIVE_DTYPE, SensorArchive, to_epoch
+
+DAY = datetime(2024, 3, 1)
+
+
+def rows(ids, device_id="dev", start=DAY, step=timedelta(hours=1)):
+    return [(i, device_id, float(i), 100.0 - i, "ON" if i % 2 else "OFF", start + step * n)
+            for n, i in enumerate(ids)]
+
+
+def test_round_trip(tmp_path):
+    archive = SensorArchive(str(tmp_path))
+    assert archive.append(rows([1, 2, 3])) == 3
+    data = archive.read("dev", to_epoch(DAY), to_epoch(DAY + timedelta(days=1)))
+    assert data["id"].tolist() == [1, 2, 3]
+    assert data["moisture"].tolist() == [1.0, 2.0, 3.0]
+    assert data["water"].tolist() == [99.0, 98.0, 97.0]
+    assert data["pump_on"].tolist() == [1, 0, 1]
+    assert data["ts"].tolist() == [to_epoch(DAY + timedelta(hours=h)) for h in range(3)]
+
+
+def test_reads_across_days_and_filters_range(tmp_path):
+    archive = SensorArchive(str(tmp_path))
+    archive.append(rows(range(1, 49)))  # two days, hourly
+    start, end = DAY + timedelta(hours=20), DAY + timedelta(hours=26)
+    data = archive.read("dev", to_epoch(start), to_epoch(end))
+    assert data["id"].tolist() == list(range(21, 27))
+
+
+def test_reappending_skips_archived_ids_in_any_order(tmp_path):
+    archive = SensorArchive(str(tmp_path))
+    archive.append(rows([5, 6]))
+    # A crash re-run repeats 5 and 6; 3 is a lower id that became visible later
+    assert archive.append(rows([5, 6, 3])) == 1
+    data = archive.read("dev", to_epoch(DAY), to_epoch(DAY + timedelta(days=1)))
+    assert sorted(data["id"].tolist()) == [3, 5, 6]
+
+
+def test_ignores_torn_trailing_record(tmp_path):
+    archive = SensorArchive(str(tmp_path))
+    archive.append(rows([1, 2]))
+    path = archive._path("dev", to_epoch(DAY))
+    with open(path, "ab") as f:
+        f.write(b"\x00" * (ARCHIVE_DTYPE.itemsize // 2))
+    data = archive.read("dev", to_epoch(DAY), to_epoch(DAY + timedelta(days=1)))
+    assert data["id"].tolist() == [1, 2]
+
+
+def test_device_ids_cannot_escape_the_archive_dir(tmp_path):
+    archive = SensorArchive(str(tmp_path))
+    archive.append(rows([1], device_id=".."))
+    files = [os.path.join(d, f) for d, _, fs in os.walk(tmp_path) for f in fs]
+    assert len(files) == 1
+    assert os.path.commonpath([files[0], str(tmp_path)]) == str(tmp_path)
+    assert archive.read("..", to_epoch(DAY), to_epoch(DAY) + 3600)["id"].tolist() == [1]
+
+
+def test_missing_day_reads_empty(tmp_path):
+    archive = SensorArchive(str(tmp_path))
+    data = archive.read("nobody", to_epoch(DAY), to_epoch(DAY + timedelta(days=3)))
+    assert len(data) == 0 and data.dtype == ARCHIVE_DTYPE
+    assert isinstance(data, np.ndarray)
+
+
+def test_archiving_deletes_only_archived_ids(tmp_path, monkeypatch):
+    import main
+    from conftest import query, run_with_app
+
+    old = DAY
+    archive = SensorArchive(str(tmp_path))
+
+    def insert(db, row_id):
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO sensor_data (id, device_id, moisture_level, water_level, pump_status, created_at)"
+                       " VALUES (%s, 'arch-race', 1, 1, 'OFF', %s)", (row_id, old))
+        cursor.close()
+
+    class LateWriter:
+        """Commits a row inside the selected id range while the chunk is being archived"""
+        late = True
+
+        def append(self, chunk):
+            if self.late:
+                self.late = False
+                db = main.db_pool.acquire()
+                try:
+                    insert(db, 1_000_002)
+                finally:
+                    db.close()
+            return archive.append(chunk)
+
+    async def scenario():
+        for row_id in (1_000_001, 1_000_003):
+            await main.run_db(insert, row_id)
+        monkeypatch.setattr(main, "sensor_archive", LateWriter())
+        return await main.run_db(main.archive_old_readings, old + timedelta(minutes=1))
+
+    assert run_with_app(scenario) == 3
+    assert query("SELECT id FROM sensor_data WHERE device_id = 'arch-race'") == []
+    data = archive.read("arch-race", to_epoch(DAY), to_epoch(DAY + timedelta(days=1)))
+    assert sorted(data["id"].tolist()) == [1_000_001, 1_000_002, 1_000_003]
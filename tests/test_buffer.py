@@ -0,0 +1,126 @@
+import asyncio
+from datetime import datetime
+
+from fastapi import HTTPException
+
+import main
+from conftest import query, run_with_app
+
+
+def reading(device_id, moisture=40.0, created_at=None):
+    return (device_id, moisture, 60.0, "OFF", created_at or datetime.utcnow())
+
+
+def count(device_id):
+    return query("SELECT COUNT(*) FROM sensor_data WHERE device_id = %s", (device_id,))[0][0]
+
+
+def test_flush_inserts_readings_and_rollups():
+    async def scenario():
+        main.sensor_buffer.add([reading("buf-ok"), reading("buf-ok", 50.0)])
+        return await main.sensor_buffer.flush()
+
+    assert run_with_app(scenario) == 2
+    assert count("buf-ok") == 2
+    assert query("""
+        SELECT samples FROM sensor_rollups WHERE device_id = %s AND resolution = 60
+    """, ("buf-ok",)) == [(2,)]
+
+
+def test_failed_flush_requeues_readings(monkeypatch):
+    async def offline(fn, *args):
+        raise HTTPException(status_code=500, detail="Database offline")
+
+    async def scenario():
+        main.sensor_buffer.add([reading("buf-retry")])
+        with monkeypatch.context() as m:
+            m.setattr(main, "run_db", offline)
+            assert await main.sensor_buffer.flush() == 0
+        assert len(main.sensor_buffer._rows) == 1
+        return await main.sensor_buffer.flush()
+
+    assert run_with_app(scenario) == 1
+    assert count("buf-retry") == 1
+
+
+def test_rejected_row_does_not_block_the_batch():
+    async def scenario():
+        # NULL moisture violates NOT NULL; the other readings must still land
+        main.sensor_buffer.add([reading("buf-bad"), reading("buf-bad", None), reading("buf-bad", 30.0)])
+        inserted = await main.sensor_buffer.flush()
+        return inserted, len(main.sensor_buffer._rows)
+
+    assert run_with_app(scenario) == (2, 0)
+    assert count("buf-bad") == 2
+    assert query("""
+        SELECT samples FROM sensor_rollups WHERE device_id = %s AND resolution = 60
+    """, ("buf-bad",)) == [(2,)]
+
+
+def test_full_buffer_drops_oldest_readings(monkeypatch):
+    async def offline(fn, *args):
+        raise HTTPException(status_code=500, detail="Database offline")
+
+    async def scenario():
+        buffer = main.SensorWriteBuffer(max_size=100, interval=60, max_pending=3)
+        buffer.add([reading("buf-full", float(m)) for m in range(5)])
+        monkeypatch.setattr(main, "run_db", offline)
+        await buffer.flush()
+        return [row[1] for row in buffer._rows]
+
+    assert run_with_app(scenario) == [2.0, 3.0, 4.0]
+
+
+def test_invalid_readings_are_rejected_at_the_api(client):
+    body = '{"moisture_level": NaN, "water_level": 10}'
+    response = client.post("/api/sensor/add", content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 422
+    response = client.post("/api/sensor/add", json={"moisture_level": 1, "water_level": 1, "pump_status": "BROKEN"})
+    assert response.status_code == 422
+    readings = [{"moisture_level": 1, "water_level": 1, "pump_status": "BROKEN"}]
+    response = client.post("/api/sensor/batch", json={"readings": readings})
+    assert response.status_code == 422
+    response = client.post("/api/sensor/save", json={"moisture_level": 1, "water_level": 1, "device_id": "x" * 65})
+    assert response.status_code == 422
+
+
+def test_firmware_pump_status_values_are_normalized(client):
+    for value, expected in [("on", "ON"), ("Off", "OFF"), (1, "ON"), ("0", "OFF"), (True, "ON")]:
+        data = main.SensorData(moisture_level=1, water_level=1, pump_status=value)
+        assert data.pump_status == expected
+    response = client.post("/api/sensor/save", json={"moisture_level": 1, "water_level": 1, "pump_status": "BROKEN"})
+    assert response.status_code == 200
+
+
+def test_add_enforces_max_pending_without_a_flush():
+    buffer = main.SensorWriteBuffer(max_size=1000, interval=60, max_pending=3)
+    buffer.add([reading("buf-cap", float(m)) for m in range(5)])
+    assert [row[1] for row in buffer._rows] == [2.0, 3.0, 4.0]
+    assert buffer.dropped == 2
+
+
+def test_stalled_flush_does_not_pile_up_flushes(monkeypatch):
+    calls = []
+
+    async def stalled(fn, *args):
+        calls.append(asyncio.get_running_loop().time())
+        await asyncio.sleep(0.2)
+        raise HTTPException(status_code=500, detail="Database offline")
+
+    async def scenario():
+        buffer = main.SensorWriteBuffer(max_size=10, interval=0.1, max_pending=500)
+        buffer.start()
+        monkeypatch.setattr(main, "run_db", stalled)
+        for m in range(2000):
+            buffer.add([reading("buf-stall", float(m))])
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.5)
+        started = asyncio.get_running_loop().time()
+        await buffer.stop()
+        return len(buffer._rows), asyncio.get_running_loop().time() - started
+
+    pending, stop_seconds = asyncio.run(scenario())
+    # One flusher with a back-off between failures, not one flush per reading
+    assert len(calls) <= 5
+    assert pending == 500
+    assert stop_seconds < 1
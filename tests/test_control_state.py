@@ -0,0 +1,32 @@
+import asyncio
+
+import main
+
+
+def fake_database(monkeypatch, rows: dict, read_delay: float):
+    """run_db stand-in: _load_control_state sees the rows as they were when the read started"""
+    async def run_db(fn, *args):
+        assert fn is main._load_control_state
+        snapshot = dict(rows)
+        await asyncio.sleep(read_delay)
+        return snapshot, []
+    monkeypatch.setattr(main, "run_db", run_db)
+
+
+def test_refresh_that_read_old_rows_cannot_overwrite_a_write(monkeypatch):
+    rows = {"manual_target": "OFF", "pause_until": None}
+    fake_database(monkeypatch, rows, read_delay=0.05)
+
+    async def scenario():
+        state = main.ControlState("race", ttl=0)
+        state.apply(dict(rows), [])
+        await state.get()  # stale: starts a background refresh that reads OFF
+        await asyncio.sleep(0)
+        async with state.writing():
+            rows["manual_target"] = "ON"
+            state.manual_target = "ON"
+        await state._refresh_task
+        return state.manual_target
+
+    assert asyncio.run(scenario()) == "ON"
+
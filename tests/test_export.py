@@ -0,0 +1,79 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import main
+
+DAY = datetime(2024, 3, 1)
+
+
+class ListCursor:
+    """fetchmany() over rows already in created_at order, like the export query"""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def fetchmany(self, size):
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+
+def test_export_merges_archive_and_table_rows_in_time_order(tmp_path, monkeypatch):
+    archive = main.SensorArchive(str(tmp_path))
+    archive.append([(i, "exp", float(h), 0.0, "OFF", DAY + timedelta(hours=h)) for i, h in enumerate((0, 2, 4, 26), 1)])
+    monkeypatch.setattr(main, "sensor_archive", archive)
+    monkeypatch.setattr(main, "EXPORT_CHUNK", 1)
+    # Backdated rows land inside archived days; 50 is after everything archived
+    table = [(DAY + timedelta(hours=h), float(h), 0.0, "ON") for h in (1, 3, 25, 50)]
+
+    start, end = DAY, DAY + timedelta(days=3)
+    chunks = main._export_chunks(ListCursor(table), "exp", main.to_epoch(start), main.to_epoch(end), "ndjson")
+    lines = [json.loads(line) for line in "".join(chunks).splitlines()]
+    assert [line["moisture_level"] for line in lines] == [0, 1, 2, 3, 4, 25, 26, 50]
+    assert [line["pump_status"] for line in lines] == ["OFF", "ON", "OFF", "ON", "OFF", "ON", "OFF", "ON"]
+
+
+class FakeExport:
+    def __init__(self):
+        self.closed = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+
+    def next_chunk(self):
+        return "row\n"
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.closed.set)
+
+
+def test_aborted_export_releases_its_slot_and_connection():
+    async def scenario(chunks_read):
+        await main.export_slots.acquire()
+        export = FakeExport()
+        stream = main._export_stream(export, "ndjson")
+        await stream.__anext__()  # primed by export_sensor_data
+        for _ in range(chunks_read):
+            await stream.__anext__()
+        await stream.aclose()  # client went away
+        await asyncio.wait_for(export.closed.wait(), 5)
+        return main.export_slots._value
+
+    for chunks_read in (0, 3):
+        assert asyncio.run(scenario(chunks_read)) == main.EXPORT_MAX_CONCURRENT
+
+
+def test_export_endpoint_streams_rows_and_frees_the_slot():
+    from fastapi.testclient import TestClient
+
+    now = datetime.utcnow().replace(microsecond=0)
+    readings = [{"moisture_level": m, "water_level": 50, "timestamp": (now - timedelta(minutes=m)).isoformat()}
+                for m in (3, 2, 1)]
+    with TestClient(main.app) as client:  # the buffer is flushed on shutdown
+        assert client.post("/api/sensor/batch", json={"device_id": "exp-api", "readings": readings}).status_code == 200
+
+    with TestClient(main.app) as client:
+        response = client.get("/api/sensor/export", params={
+            "device_id": "exp-api", "start": (now - timedelta(hours=1)).isoformat(), "end": now.isoformat()})
+        assert main.export_slots._value == main.EXPORT_MAX_CONCURRENT
+    lines = response.text.splitlines()
+    assert lines[0] == ",".join(main.EXPORT_COLUMNS)
+    assert [float(line.split(",")[2]) for line in lines[1:]] == [3.0, 2.0, 1.0]
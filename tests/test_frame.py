@@ -0,0 +1,54 @@
+import struct
+from datetime import datetime
+
+import pytest
+
+from main import DEFAULT_DEVICE, FRAME_HEADER, FRAME_READING, decode_frame
+
+NOW = datetime(2024, 1, 1, 12, 0)
+
+
+def frame(device_id=b"esp-1", readings=((0, 345, 812, 0),), version=1, count=None):
+    header = FRAME_HEADER.pack(version, device_id, len(readings) if count is None else count)
+    return header + b"".join(FRAME_READING.pack(*r) for r in readings)
+
+
+def test_decodes_single_reading_with_server_time():
+    device_id, rows = decode_frame(frame(), NOW)
+    assert device_id == "esp-1"
+    assert rows == [("esp-1", 34.5, 81.2, "OFF", NOW)]
+
+
+def test_decodes_packed_readings_with_device_time():
+    _, rows = decode_frame(frame(readings=((1700000000, 100, 200, 1), (1700000060, 110, 210, 0))), NOW)
+    assert rows == [
+        ("esp-1", 10.0, 20.0, "ON", datetime(2023, 11, 14, 22, 13, 20)),
+        ("esp-1", 11.0, 21.0, "OFF", datetime(2023, 11, 14, 22, 14, 20)),
+    ]
+
+
+def test_empty_device_id_means_default_device():
+    assert decode_frame(frame(device_id=b""), NOW)[0] == DEFAULT_DEVICE
+
+
+@pytest.mark.parametrize("payload, message", [
+    (b"", "shorter than header"),
+    (frame()[:FRAME_HEADER.size - 1], "shorter than header"),
+    (frame(version=2), "unsupported frame version"),
+    (frame(readings=(), count=0), "reading count"),
+    (frame()[:-1], "does not match"),
+    (frame() + b"\x00", "does not match"),
+    (frame(count=2), "does not match"),
+    (frame(device_id=b"\xffbad"), "ASCII"),
+    (frame(device_id=b"a/b"), "invalid characters"),
+])
+def test_rejects_malformed_frames(payload, message):
+    with pytest.raises(ValueError, match=message):
+        decode_frame(payload, NOW)
+
+
+def test_frame_endpoint_replies_with_command_byte(client):
+    response = client.post("/api/sensor/frame", content=frame(device_id=b"frame-http"))
+    assert response.status_code == 200
+    assert response.content == b"\x00"
+    assert client.post("/api/sensor/frame", content=b"junk").status_code == 400
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+import main
+
+T0 = datetime(2024, 3, 1, 12, 0)
+
+
+def row(device_id, moisture, at=T0):
+    return (device_id, moisture, 50.0, "OFF", at)
+
+
+def test_slow_subscriber_loses_oldest_events():
+    hub = main.LiveHub(queue_size=2, max_devices=10)
+    everything = hub.subscribe()
+    only_b = hub.subscribe("b")
+    for n in range(3):
+        hub.publish("a", {"n": n})
+    hub.publish("b", {"n": 3})
+    assert [everything.get_nowait()["n"] for _ in range(everything.qsize())] == [2, 3]
+    assert [only_b.get_nowait()["n"] for _ in range(only_b.qsize())] == [3]
+    assert hub.dropped == 2
+
+
+def test_older_reading_does_not_replace_latest():
+    hub = main.LiveHub(queue_size=2, max_devices=10)
+    assert hub.remember_reading(row("a", 1.0, T0))
+    assert not hub.remember_reading(row("a", 2.0, T0 - timedelta(seconds=1)))
+    assert hub.latest["a"]["moisture_level"] == 1.0
+
+
+def test_fresh_latest_expires_after_ttl(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(main, "monotonic", lambda: clock[0])
+    hub = main.LiveHub(queue_size=2, max_devices=10)
+    hub.remember_reading(row("a", 1.0))
+    assert hub.fresh_latest("a", ttl=5) is None  # never compared with the database
+    hub.checked_at["a"] = clock[0]
+    clock[0] += 4.9
+    assert hub.fresh_latest("a", ttl=5)["moisture_level"] == 1.0
+    clock[0] += 0.1
+    assert hub.fresh_latest("a", ttl=5) is None
+
+
+def test_latest_endpoint_reads_the_database_once_per_ttl(client, monkeypatch):
+    calls = []
+
+    def fetch_latest(db, device_id):
+        calls.append(device_id)
+        return {"moisture_level": 42.0, "water_level": 50.0, "pump_status": "OFF", "created_at": T0}
+
+    monkeypatch.setattr(main, "_fetch_latest", fetch_latest)
+    monkeypatch.setattr(main, "LIVE_LATEST_TTL", 60)
+    for _ in range(3):
+        assert client.get("/api/sensor/latest", params={"device_id": "hub-ttl"}).json()["moisture_level"] == 42.0
+    assert calls == ["hub-ttl"]
+    monkeypatch.setattr(main, "LIVE_LATEST_TTL", 0)
+    client.get("/api/sensor/latest", params={"device_id": "hub-ttl"})
+    assert calls == ["hub-ttl", "hub-ttl"]
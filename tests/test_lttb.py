@@ -0,0 +1,29 @@
+import numpy as np
+
+from main import lttb_indices
+
+
+def test_returns_all_points_when_not_downsampling():
+    x = np.arange(10, dtype=float)
+    assert lttb_indices(x, x, 10).tolist() == list(range(10))
+    assert lttb_indices(x, x, 50).tolist() == list(range(10))
+    assert lttb_indices(x, x, 2).tolist() == list(range(10))
+
+
+def test_keeps_endpoints_and_count_in_order():
+    rng = np.random.default_rng(0)
+    x = np.arange(1000, dtype=float)
+    y = rng.normal(size=1000)
+    idx = lttb_indices(x, y, 50)
+    assert len(idx) == 50
+    assert idx[0] == 0 and idx[-1] == 999
+    assert (np.diff(idx) > 0).all()
+
+
+def test_keeps_spikes():
+    x = np.arange(500, dtype=float)
+    y = np.zeros(500)
+    y[123] = 100
+    y[377] = -100
+    idx = lttb_indices(x, y, 20)
+    assert 123 in idx and 377 in idx
@@ -0,0 +1,46 @@
+import asyncio
+
+import main
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = main.Histogram("t_seconds", "test", ("route",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(("/a",), value)
+    assert histogram.render()[2:] == [
+        't_seconds_bucket{route="/a",le="0.1"} 2',
+        't_seconds_bucket{route="/a",le="1"} 3',
+        't_seconds_bucket{route="/a",le="+Inf"} 4',
+        't_seconds_sum{route="/a"} 3.65',
+        't_seconds_count{route="/a"} 4',
+    ]
+
+
+def series(route: str) -> list:
+    return [line for line in main.http_request_seconds.render()
+            if line.startswith("http_request_duration_seconds_count") and f'route="{route}"' in line]
+
+
+def test_requests_are_labelled_by_route_template(client):
+    client.delete("/api/schedule/987654")
+    client.delete("/api/schedule/987655")
+    assert sum(int(line.split()[-1]) for line in series("/api/schedule/{schedule_id}")) >= 2
+    assert series("/api/schedule/987654") == []
+    assert "http_request_duration_seconds" in client.get("/metrics").text
+
+
+def test_streaming_routes_are_timed_until_the_response_starts():
+    async def streaming(scope, receive, send):
+        scope["endpoint"] = main.export_sensor_data
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await asyncio.sleep(0.3)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": "/api/sensor/export"}
+    labels = ("GET", "/api/sensor/export", 200)
+    before = main.http_request_seconds._series.get(labels, [None, 0.0])[1]
+    asyncio.run(main.MetricsMiddleware(streaming)(scope, None, send))
+    assert main.http_request_seconds._series[labels][1] - before < 0.1
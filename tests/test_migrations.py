@@ -0,0 +1,60 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def db(tmp_path):
+    conn = main.SQLiteConnection(str(tmp_path / "migrate.db"))
+    yield conn
+    conn.close()
+
+
+def rows(db, sql):
+    cursor = db.cursor()
+    cursor.execute(sql)
+    result = cursor.fetchall()
+    cursor.close()
+    return result
+
+
+def test_migrating_twice_is_a_no_op(db):
+    latest = main.MIGRATIONS[-1][0]
+    assert main.migrate(db) == latest
+    assert main.migrate(db) == latest
+    assert [r[0] for r in rows(db, "SELECT version FROM schema_migrations ORDER BY version")] == \
+        [version for version, _, _ in main.MIGRATIONS]
+    assert rows(db, "SELECT device_id, manual_target FROM pump_control") == [(main.DEFAULT_DEVICE, "OFF")]
+
+
+def test_legacy_control_rows_collapse_to_the_newest(db):
+    # Hand-made schema from before migrations: several control rows, no device_id
+    cursor = db.cursor()
+    cursor.execute("""
+        CREATE TABLE pump_control (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            manual_target VARCHAR(3) NOT NULL DEFAULT 'OFF',
+            pause_until DATETIME NULL
+        )
+    """)
+    cursor.executemany("INSERT INTO pump_control (manual_target) VALUES (%s)", [("OFF",), ("OFF",), ("ON",)])
+    cursor.close()
+
+    main.migrate(db)
+    assert rows(db, "SELECT id, device_id, manual_target FROM pump_control") == [(3, main.DEFAULT_DEVICE, "ON")]
+
+
+def test_query_plans_report_a_missing_index(db, tmp_path):
+    main.migrate(db)
+    assert set(main.check_query_plans(db).values()) == {"ok"}
+
+    cursor = db.cursor()
+    cursor.execute("DROP INDEX idx_sensor_device_time")
+    cursor.close()
+    # Checked at startup: a new connection, so no cached EXPLAIN statements
+    restarted = main.SQLiteConnection(str(tmp_path / "migrate.db"))
+    plans = main.check_query_plans(restarted)
+    restarted.close()
+    assert plans["latest reading"].startswith("not using idx_sensor_device_time")
+    assert plans["history range"].startswith("not using idx_sensor_device_time")
+    assert plans["control lookup"] == "ok"
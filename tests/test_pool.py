@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from main import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.healthy = True
+        self.closed = False
+
+    def is_connected(self):
+        return self.healthy
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(size=2, timeout=0.05, max_idle=300, ping_after=30):
+    opened = []
+
+    def connect():
+        conn = FakeConnection()
+        opened.append(conn)
+        return conn
+
+    return ConnectionPool(connect, size=size, timeout=timeout, max_idle=max_idle, ping_after=ping_after), opened
+
+
+def test_checkout_reuses_released_connection():
+    pool, opened = make_pool()
+    db = pool.acquire()
+    db.close()
+    db = pool.acquire()
+    db.close()
+    assert len(opened) == 1
+    assert pool.stats() == {"size": 2, "open": 1, "idle": 1}
+
+
+def test_checkout_times_out_when_exhausted():
+    pool, _ = make_pool(size=1)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    held.close()
+    pool.acquire().close()
+
+
+def test_waiter_gets_connection_released_by_another_thread():
+    pool, opened = make_pool(size=1, timeout=2)
+    held = pool.acquire()
+    threading.Timer(0.05, held.close).start()
+    pool.acquire().close()
+    assert len(opened) == 1
+
+
+def test_failed_connect_frees_its_slot():
+    def connect():
+        raise ConnectionError("refused")
+
+    pool = ConnectionPool(connect, size=1, timeout=0.05, max_idle=300, ping_after=30)
+    with pytest.raises(ConnectionError):
+        pool.acquire()
+    assert pool.stats()["open"] == 0
+
+
+def test_unhealthy_idle_connection_is_replaced():
+    pool, opened = make_pool(ping_after=0)
+    db = pool.acquire()
+    db.close()
+    opened[0].healthy = False
+    pool.acquire().close()
+    assert opened[0].closed
+    assert len(opened) == 2
+    assert pool.stats()["open"] == 1
+
+
+def test_invalidate_discards_instead_of_returning():
+    pool, opened = make_pool()
+    db = pool.acquire()
+    db.invalidate()
+    db.close()
+    assert opened[0].closed
+    assert pool.stats() == {"size": 2, "open": 0, "idle": 0}
+
+
+def test_reap_closes_only_connections_idle_too_long():
+    pool, opened = make_pool(max_idle=0.05)
+    first, second = pool.acquire(), pool.acquire()
+    first.close()
+    time.sleep(0.1)
+    second.close()
+    assert pool.reap_idle() == 1
+    assert opened[0].closed and not opened[1].closed
+    assert pool.stats() == {"size": 2, "open": 1, "idle": 1}
@@ -0,0 +1,69 @@
+from datetime import datetime, time
+
+from main import ALL_WEEKDAYS, ScheduleIndex, days_to_weekdays
+
+# 2024-01-01 is a Monday
+MONDAY = datetime(2024, 1, 1)
+
+
+def at(day: int, hour: int, minute: int = 0) -> datetime:
+    return MONDAY.replace(day=1 + day, hour=hour, minute=minute)
+
+
+def test_daytime_schedule():
+    index = ScheduleIndex([(time(6, 0), time(6, 30), ALL_WEEKDAYS)])
+    assert not index.is_on(at(0, 5, 59))
+    assert index.is_on(at(0, 6, 0))
+    assert index.is_on(at(0, 6, 29))
+
+
+def test_off_time_is_exclusive():
+    # The pre-index code kept the pump on through the off_time minute;
+    # off_time is now the first minute the pump is off
+    index = ScheduleIndex([(time(6, 0), time(6, 30), ALL_WEEKDAYS)])
+    assert not index.is_on(at(0, 6, 30))
+
+
+def test_off_time_with_seconds_covers_its_minute():
+    index = ScheduleIndex([(time(0, 0), time(23, 59, 59), ALL_WEEKDAYS)])
+    assert index.is_on(at(2, 0, 0))
+    assert index.is_on(at(2, 23, 59))
+
+
+def test_overnight_schedule_belongs_to_its_start_day():
+    index = ScheduleIndex([(time(22, 0), time(6, 0), days_to_weekdays([0]))])  # Monday night
+    assert index.is_on(at(0, 23, 0))
+    assert index.is_on(at(1, 5, 59))   # early Tuesday
+    assert not index.is_on(at(1, 6, 0))
+    assert not index.is_on(at(1, 23, 0))  # Tuesday night is not scheduled
+    assert not index.is_on(at(0, 3, 0))   # nor is early Monday
+
+
+def test_sunday_overnight_wraps_into_monday():
+    index = ScheduleIndex([(time(23, 0), time(1, 0), days_to_weekdays([6]))])
+    assert index.is_on(at(6, 23, 30))
+    assert index.is_on(at(0, 0, 30))
+    assert not index.is_on(at(0, 1, 0))
+
+
+def test_weekday_mask_limits_days():
+    index = ScheduleIndex([(time(8, 0), time(9, 0), days_to_weekdays([0, 2, 4]))])
+    assert [index.is_on(at(day, 8, 30)) for day in range(7)] == [True, False, True, False, True, False, False]
+
+
+def test_next_transition():
+    index = ScheduleIndex([(time(6, 0), time(6, 30), ALL_WEEKDAYS)])
+    assert index.next_transition(at(0, 5, 0)) == at(0, 6, 0)
+    assert index.next_transition(at(0, 6, 10)) == at(0, 6, 30)
+    assert index.next_transition(at(0, 7, 0)) == at(1, 6, 0)
+
+
+def test_next_transition_wraps_around_the_week():
+    index = ScheduleIndex([(time(6, 0), time(7, 0), days_to_weekdays([0]))])
+    assert index.next_transition(at(6, 12, 0)) == datetime(2024, 1, 8, 6, 0)
+
+
+def test_no_transitions_without_schedules_or_when_always_on():
+    assert ScheduleIndex().next_transition(MONDAY) is None
+    always = ScheduleIndex([(time(0, 0), time(23, 59, 59), ALL_WEEKDAYS)])
+    assert always.next_transition(MONDAY) is None